@@ -1 +1,9 @@
 from .amp_extract import Calc
+from .amp_store import RaggedArray, ResultStore
+from .amp_cache import FingerprintCache
+from .amp_metrics import ErrorMetrics
+from .amp_series import CheckpointSeries
+from .amp_profile import PhaseProfiler
+from .amp_numpy import NumpyAmp
+from .amp_neighbors import NeighborList
+from .amp_pipeline import WriterStage
@@ -0,0 +1,148 @@
+"""
+Module allowing to keep the AMP fingerprint databases between runs, instead
+of deleting them with Calc.clean. The databases are stored in a cache
+directory, in one partition per set of descriptor parameters:
+    - [cache_dir]/[descriptor hash]/amp-fingerprints.ampdb
+    - [cache_dir]/[descriptor hash]/amp-fingerprint-primes.ampdb
+    - [cache_dir]/[descriptor hash]/amp-neighborlists.ampdb
+Inside a partition, AMP stores one entry per image, keyed by the hash of its
+atomic numbers, positions, cell and periodic boundary conditions, and only
+computes the missing ones. The total size of the cache can be bounded, the
+least recently used images being evicted first.
+"""
+
+# IMPORTATIONS
+
+import os
+import hashlib
+
+# CONSTANTS
+
+# Suffixes of the AMP databases handled by the cache
+DB_SUFFIXES = (
+    "-fingerprints.ampdb",
+    "-fingerprint-primes.ampdb",
+    "-neighborlists.ampdb",
+)
+
+# FUNCTIONS
+
+
+def read_descriptor(amp_filename):
+    """
+    Read the descriptor parameters of an .amp file, as written by AMP
+
+    Args:
+        - amp_filename (str): Filename for the amp calc object
+
+    Returns:
+        - str: String representation of the descriptor
+    """
+    with open(amp_filename) as infile:
+        text = infile.read()
+    return eval(text, {"__builtins__": {}, "dict": dict})["descriptor"]
+
+
+# CLASSES
+
+
+class FingerprintCache:
+    def __init__(self, cache_dir: str, max_size: float = None):
+        """
+        Persistent cache of the AMP fingerprints
+
+        Args:
+            - cache_dir (str): Directory of the cache
+            - max_size (float, optional): Maximum size of the cache in MB.
+                Defaults to None (no limit).
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def dblabel(self, amp_filename):
+        """
+        Database label to give to the Amp calculator of an .amp file.
+        The partition is named after the hash of the descriptor parameters.
+
+        Args:
+            - amp_filename (str): Filename for the amp calc object
+
+        Returns:
+            - str: The dblabel
+        """
+        descriptor = read_descriptor(amp_filename)
+        partition = hashlib.md5(descriptor.encode()).hexdigest()
+        os.makedirs(os.path.join(self.cache_dir, partition), exist_ok=True)
+        return os.path.join(self.cache_dir, partition, "amp")
+
+    def _loose_paths(self, dblabel, key):
+        for suffix in DB_SUFFIXES:
+            yield os.path.join(dblabel + suffix, "loose", key)
+
+    def touch(self, dblabel, keys):
+        """
+        Mark the entries of the given image hashes as recently used
+
+        Args:
+            - dblabel (str): Label returned by dblabel
+            - keys (iterable): Image hashes
+        """
+        for key in keys:
+            for path in self._loose_paths(dblabel, key):
+                if os.path.exists(path):
+                    os.utime(path)
+
+    def entries(self):
+        """
+        List the images stored in the cache
+
+        Returns:
+            - dict: (dblabel, key) -> (last use time, size in bytes)
+        """
+        entries = {}
+        for partition in os.listdir(self.cache_dir):
+            dblabel = os.path.join(self.cache_dir, partition, "amp")
+            for suffix in DB_SUFFIXES:
+                loose = os.path.join(dblabel + suffix, "loose")
+                if not os.path.isdir(loose):
+                    continue
+                for key in os.listdir(loose):
+                    stat = os.stat(os.path.join(loose, key))
+                    last_use, size = entries.get((dblabel, key), (0.0, 0))
+                    entries[(dblabel, key)] = (
+                        max(last_use, stat.st_mtime),
+                        size + stat.st_size,
+                    )
+        return entries
+
+    def size(self):
+        """
+        Total size of the cache in MB
+        """
+        return sum(size for _, size in self.entries().values()) / 1e6
+
+    def evict(self):
+        """
+        Remove the least recently used images until the cache fits in
+        max_size. Only the loose entries of the databases are evicted.
+
+        Returns:
+            - int: Number of evicted images
+        """
+        if self.max_size is None:
+            return 0
+        entries = self.entries()
+        total = sum(size for _, size in entries.values())
+        evicted = 0
+        for (dblabel, key), (_, size) in sorted(
+            entries.items(), key=lambda item: item[1][0]
+        ):
+            if total <= self.max_size * 1e6:
+                break
+            for path in self._loose_paths(dblabel, key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+            evicted += 1
+        return evicted
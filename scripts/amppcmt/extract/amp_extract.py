@@ -12,15 +12,442 @@ the one found for aeneth data treatment.
 # IMPORTATIONS
 
 import os
+import json
+import logging
 import shutil
-from ase.io import iread
+import socket
+import tempfile
+import multiprocessing
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+from ase.io.formats import string2index
 from ase import Atoms
 from amp import Amp
+from amp.utilities import get_hash, hash_images
 import numpy as np
+from .amp_store import RaggedArray, StoreWriter
+from .amp_cache import FingerprintCache
+from .amp_metrics import ErrorMetrics
+from .amp_profile import PhaseProfiler
+from .amp_numpy import NumpyAmp
+from .amp_pipeline import WriterStage, prefetch
+from ..split.amp_manifest import TrajectoryView, count_frames, iread_frames
+from ..split.amp_manifest import read_frames as read_indexed_frames
+from ..split.amp_index import TrajectoryIndex
+
+# CONSTANTS
+
+# Number of frames sent at once to a worker if no batch_size is given
+SHARD_SIZE = 10
+
+# Number of frames evaluated at once by the numpy evaluator if no
+# batch_size is given
+NUMPY_BATCH_SIZE = 100
+
+# Number of frames formatted at once by the writers
+WRITE_CHUNK = 1000
+
+# Amp calculator of a worker process, loaded once by _init_worker
+_worker_calc = None
+
+logger = logging.getLogger(__name__)
+
+# FUNCTIONS
+
+
+def batches(iterable, size):
+    """
+    Group the items of an iterable into lists of (at most) size items
+
+    Args:
+        - iterable (iterable): Items to group, e.g. an iread generator
+        - size (int): Number of items per list
+
+    Yields:
+        - list: The next block of items
+    """
+    iterator = iter(iterable)
+    block = list(islice(iterator, size))
+    while block:
+        yield block
+        block = list(islice(iterator, size))
+
+
+def select_frames(nb_frames, frames=None, nb_random_frames=None, seed=None):
+    """
+    Resolve a frame selection into the sorted indices of the selected frames
+
+    Args:
+        - nb_frames (int): Number of frames of the trajectory
+        - frames (slice, str, int or list, optional): Selected frames, as a
+            slice, a string like '100:2000:10' (ase syntax), a single index
+            or a list of indices. Defaults to None (all the frames).
+        - nb_random_frames (int, optional): Number of frames drawn at random,
+            without replacement, among the selected ones. Defaults to None
+            (no sampling).
+        - seed (int, optional): Seed of the random sampling.
+            Defaults to None.
+
+    Returns:
+        - np.ndarray: Indices of the selected frames, in increasing order
+    """
+    if frames is None:
+        frames = slice(None)
+    if isinstance(frames, str):
+        frames = string2index(frames)
+    if isinstance(frames, slice):
+        indices = np.arange(nb_frames)[frames]
+    else:
+        indices = np.atleast_1d(np.asarray(frames, dtype=np.int64))
+        if np.any(indices >= nb_frames) or np.any(indices < -nb_frames):
+            raise IndexError(
+                "frame indices out of range for {} frames".format(nb_frames)
+            )
+        indices = indices % nb_frames
+    indices = np.unique(indices)
+    if nb_random_frames is not None and nb_random_frames < len(indices):
+        rng = np.random.default_rng(seed)
+        indices = np.sort(rng.choice(indices, size=nb_random_frames, replace=False))
+    return indices
+
+
+def read_frames(filename, indices=None, start=0):
+    """
+    Iterate over the selected frames of a trajectory. The frames of a .traj
+    file, or of a file with byte offsets in its sidecar index (see
+    amp_index), are accessed directly, the unselected ones being neither
+    read nor decoded. For the other formats, the unselected frames are
+    skipped while reading the file with iread.
+
+    Args:
+        - filename (str): Filename for the trajectory
+        - indices (list, optional): Sorted indices of the selected frames.
+            Defaults to None (all the frames).
+        - start (int, optional): Number of selected frames to skip, e.g.
+            already extracted before a checkpoint. Defaults to 0.
+
+    Yields:
+        - ase.Atoms: The selected frames
+    """
+    if indices is None:
+        yield from iread_frames(filename, start)
+        return
+    yield from read_indexed_frames(filename, indices[start:])
+
+
+def amp_fingerprints(calc, images):
+    """
+    Compute the fingerprints and fingerprint derivatives of a block of images
+    in one call of the descriptor of an Amp calculator.
+
+    Args:
+        - calc (Amp): Loaded Amp calculator
+        - images (list): List of ase.Atoms objects
+
+    Returns:
+        - list: Hashes of the images, i.e. their keys in the fingerprint
+            databases of the descriptor
+    """
+    keys = [get_hash(atoms) for atoms in images]
+    calc.descriptor.calculate_fingerprints(
+        images=hash_images(images),
+        parallel={"cores": 1},
+        log=calc._log,
+        calculate_derivatives=True,
+    )
+    return keys
+
+
+def amp_evaluate(model, descriptor, keys):
+    """
+    Evaluate a model on fingerprints already computed by a descriptor
+
+    Args:
+        - model (Model): Model of an Amp calculator
+        - descriptor (Descriptor): Descriptor holding the fingerprints
+        - keys (list): Hashes of the images returned by amp_fingerprints
+
+    Returns:
+        - energies (np.ndarray): Energies of the images, shape (n_images,)
+        - forces (list): Forces of each image as (n_atoms, 3) arrays
+    """
+    fingerprints = descriptor.fingerprints
+    fingerprintprimes = descriptor.fingerprintprimes
+    energies = np.array([model.calculate_energy(fingerprints[key]) for key in keys])
+    forces = [
+        model.calculate_forces(fingerprints[key], fingerprintprimes[key])
+        for key in keys
+    ]
+    return energies, forces
+
+
+def amp_predict(calc, images):
+    """
+    Predict energies and forces of a block of images with an Amp calculator.
+
+    The fingerprints and fingerprint derivatives of the whole block are
+    computed in one call of the descriptor, then the model is evaluated on
+    each image. The values are the same as the ones obtained with
+    get_potential_energy() and get_forces() image by image.
+
+    Args:
+        - calc (Amp): Loaded Amp calculator
+        - images (list): List of ase.Atoms objects
+
+    Returns:
+        - energies (np.ndarray): Energies of the images, shape (n_images,)
+        - forces (list): Forces of each image as (n_atoms, 3) arrays
+    """
+    keys = amp_fingerprints(calc, images)
+    return amp_evaluate(calc.model, calc.descriptor, keys)
+
+
+def build_amp_atoms(atoms):
+    """
+    Build the atom object given to the amp calculator from a frame
+
+    Args:
+        - atoms (ase.Atoms): Frame of a trajectory
+
+    Returns:
+        - ase.Atoms: Atom object with the same symbols and positions
+    """
+    return Atoms(
+        symbols=atoms.get_chemical_symbols(),
+        positions=atoms.get_positions(),
+    )
+
+
+def format_energies(energies, start=0):
+    """
+    Format energies in the aenet like energies file format. All the lines
+    are rendered with a single call of str.format.
+
+    Args:
+        - energies (iterable): Energies of consecutive frames
+        - start (int, optional): Index of the first frame. Defaults to 0.
+
+    Returns:
+        - str: One line per frame
+    """
+    energies = np.asarray(energies, dtype=float).ravel().tolist()
+    values = [None] * (2 * len(energies))
+    values[0::2] = range(start + 1, start + len(energies) + 1)
+    values[1::2] = energies
+    return ("{:>12} {:>15.8f}\n" * len(energies)).format(*values)
+
+
+@lru_cache(maxsize=None)
+def forces_template(nb_atoms):
+    """
+    Build the format string of the forces of a frame of nb_atoms atoms.
+    The atom numbers are written in the template, so that the forces of the
+    frame are rendered with a single call of str.format.
+
+    Args:
+        - nb_atoms (int): Number of atoms in the frame
+
+    Returns:
+        - str: Format string with 3 fields per atom
+    """
+    lines = [
+        "{0:>3} ".format(atom_counter + 1) + "{:>15.8f} {:>15.8f} {:>15.8f}\n"
+        for atom_counter in range(nb_atoms)
+    ]
+    return "".join(lines) + "\n"
+
+
+def format_forces(forces):
+    """
+    Format the forces of one frame in the aenet like forces file format
+
+    Args:
+        - forces (np.ndarray): Forces of the frame, shape (n_atoms, 3)
+
+    Returns:
+        - str: One line per atom followed by an empty line
+    """
+    forces = np.asarray(forces, dtype=float)
+    return forces_template(len(forces)).format(*forces.ravel().tolist())
+
+
+def format_frames_forces(forces):
+    """
+    Format the forces of several frames in the aenet like forces file format.
+    If all the frames have the same number of atoms (3D array or uniform
+    RaggedArray), the whole block is rendered at once.
+
+    Args:
+        - forces (iterable): Forces of the frames, one (n_atoms, 3) array
+            per frame, or a RaggedArray
+
+    Returns:
+        - str: The blocks of the frames, each one followed by an empty line
+    """
+    if isinstance(forces, RaggedArray) and forces.is_uniform():
+        forces = forces.to_uniform()
+    if isinstance(forces, np.ndarray) and forces.ndim == 3:
+        template = forces_template(forces.shape[1]) * forces.shape[0]
+        return template.format(*forces.ravel().tolist())
+    return "".join(format_forces(frame_forces) for frame_forces in forces)
+
+
+def same_file(filename, other_filename):
+    """
+    Check whether two filenames point to the same file
+
+    Args:
+        - filename (str): First filename
+        - other_filename (str): Second filename
+
+    Returns:
+        - bool: True if both filenames point to the same file
+    """
+    try:
+        return os.path.samefile(filename, other_filename)
+    except OSError:
+        return os.path.abspath(filename) == os.path.abspath(other_filename)
+
+
+def detect_workers():
+    """
+    Guess the number of cores available on the current node. Inside a PBS
+    job, the lines of $PBS_NODEFILE matching the node are counted (same
+    logic as the cores dictionary of the PBS script), otherwise the CPU
+    affinity of the process is used.
+
+    Returns:
+        - int: Number of cores
+    """
+    nodefile = os.environ.get("PBS_NODEFILE")
+    if nodefile and os.path.isfile(nodefile):
+        hostname = socket.gethostname().split(".")[0]
+        with open(nodefile) as infile:
+            nodes = [line.strip().split(".")[0] for line in infile if line.strip()]
+        if nodes.count(hostname):
+            return nodes.count(hostname)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _init_worker(amp_filename, dbdir, dblabel=None, evaluator="amp", skin=0.0):
+    """
+    Load the Amp calculator of a worker process. Each worker gets its own
+    label so that the ampdb databases and logfiles do not collide, unless
+    the databases of a fingerprint cache are given with dblabel.
+    """
+    global _worker_calc
+    if evaluator == "numpy":
+        _worker_calc = NumpyAmp(amp_filename, skin=skin)
+        return
+    label = os.path.join(dbdir, "amp-{}".format(os.getpid()))
+    _worker_calc = Amp.load(amp_filename, label=label, dblabel=dblabel, cores=1)
+
+
+def _predict_shard(images):
+    """
+    Predict a block of images in a worker process
+    """
+    if isinstance(_worker_calc, NumpyAmp):
+        return _worker_calc.predict(images)
+    return amp_predict(_worker_calc, images)
+
 
 # CLASSES
 
 
+class FrameWriter:
+    def __init__(
+        self, energies_filename: str, forces_filename: str, resume: dict = None
+    ):
+        """
+        Incremental writer for the energies and forces files of one data set
+        (src or amp). The frames are written as soon as they are given,
+        with the same format as Calc.write_energies and Calc.write_forces.
+
+        Args:
+            - energies_filename (str): Outfile name for the energies
+            - forces_filename (str): Outfile name for the forces
+            - resume (dict, optional): State returned by get_state at a
+                checkpoint. The outfiles are truncated to this state and
+                completed. Defaults to None (new outfiles).
+        """
+        if resume is None:
+            resume = {"nb_points": 0, "energies_size": 0, "forces_size": 0}
+            mode = "w"
+        else:
+            os.truncate(energies_filename, resume["energies_size"])
+            os.truncate(forces_filename, resume["forces_size"])
+            mode = "a"
+        self.energies_file = open(energies_filename, mode)
+        self.forces_file = open(forces_filename, mode)
+        self.nb_points = resume["nb_points"]
+        # The outfiles are pure ASCII, their sizes are the lengths written
+        self.energies_size = resume["energies_size"]
+        self.forces_size = resume["forces_size"]
+        self.states = {self.nb_points: (self.energies_size, self.forces_size)}
+
+    def write(self, energies, forces):
+        """
+        Write a block of frames
+
+        Args:
+            - energies (iterable): Energies of the frames
+            - forces (iterable): Forces of the frames, one (n_atoms, 3)
+                array per frame
+        """
+        energies = list(energies)
+        energies_text = format_energies(energies, start=self.nb_points)
+        forces_text = format_frames_forces(forces)
+        self.energies_file.write(energies_text)
+        self.forces_file.write(forces_text)
+        self.nb_points += len(energies)
+        self.energies_size += len(energies_text)
+        self.forces_size += len(forces_text)
+        self.states[self.nb_points] = (self.energies_size, self.forces_size)
+
+    def get_state(self, nb_points):
+        """
+        State of the outfiles after their first nb_points frames, or None if
+        this number does not end a written block
+
+        Returns:
+            - dict: Number of frames and sizes of the outfiles
+        """
+        if nb_points not in self.states:
+            return None
+        energies_size, forces_size = self.states[nb_points]
+        return {
+            "nb_points": nb_points,
+            "energies_size": energies_size,
+            "forces_size": forces_size,
+        }
+
+    def forget(self, nb_points):
+        """
+        Drop the states of the blocks ending before nb_points frames
+        """
+        for key in [key for key in self.states if key < nb_points]:
+            del self.states[key]
+
+    def flush(self):
+        """
+        Flush both outfiles
+        """
+        self.energies_file.flush()
+        self.forces_file.flush()
+
+    def close(self):
+        """
+        Close both outfiles
+        """
+        self.energies_file.close()
+        self.forces_file.close()
+
+
 class Calc:
     def __init__(
         self,
@@ -31,6 +458,27 @@ class Calc:
         amp_forces_outfilename: str = "amp_forces.dat",
         src_energies_outfilename: str = "src_energies.dat",
         src_forces_outfilename: str = "src_forces.dat",
+        batch_size: int = None,
+        parallel: bool = False,
+        workers: int = None,
+        stream: bool = False,
+        store_dirname: str = None,
+        cache_dir: str = None,
+        cache_size: float = None,
+        single_pass: bool = None,
+        metrics_filename: str = None,
+        checkpoint_filename: str = None,
+        checkpoint_interval: int = 100,
+        frames=None,
+        nb_random_frames: int = None,
+        seed: int = None,
+        profile: bool = False,
+        profile_filename: str = None,
+        profile_memory: bool = False,
+        evaluator: str = "amp",
+        neighbor_skin: float = 0.0,
+        pipeline: bool = False,
+        queue_size: int = 4,
     ):
         """
         Class allowing to extract AMP results in four different files.
@@ -46,9 +494,12 @@ class Calc:
 
         Args:
             - amp_filename (str): Filename for the amp calc object
-            - traj_filename (str): Filename for the trajectory
-            - generated_traj_filename (str):
-                Filename for the generated (AMP) trajectory
+            - traj_filename (str or TrajectoryView): Filename for the
+                trajectory, or a view on some of its frames (e.g. the test
+                set of a split manifest, see amp_manifest)
+            - generated_traj_filename (str or TrajectoryView):
+                Filename for the generated (AMP) trajectory, or a view on the
+                same frames
             - amp_energies_outfilename (str, optional):
                 Outfile name for the amp energies. Defaults to 'amp_energies.dat'.
             - amp_forces_outfilename (str, optional):
@@ -57,14 +508,128 @@ class Calc:
                 Outfile name for the source energies. Defaults to 'src_energies.dat'.
             - src_forces_outfilename (str, optional):
                 Outfile name for the source forces. Defaults to 'src_forces.dat'.
+            - batch_size (int, optional):
+                Number of generated frames handed to AMP at once. The
+                fingerprints of a whole block are computed in a single
+                descriptor call. Defaults to None (frame by frame).
+            - parallel (bool, optional):
+                Predict the generated trajectory with a pool of processes.
+                Blocks of consecutive frames are sent to the workers and the
+                results are merged back in frame order. Defaults to False.
+            - workers (int, optional):
+                Number of worker processes. Defaults to None (guessed from
+                $PBS_NODEFILE or the CPU affinity).
+            - stream (bool, optional):
+                Write each frame to the outfiles as soon as it is processed
+                by predict, instead of keeping all the data in memory.
+                Defaults to False.
+            - store_dirname (str, optional):
+                Directory of a binary result store (see amp_store) written
+                alongside the .dat files. Defaults to None (no store).
+            - cache_dir (str, optional):
+                Directory of a persistent fingerprint cache (see amp_cache).
+                The fingerprints of already seen images are not computed
+                again. Defaults to None (ampdb databases in the working
+                directory).
+            - cache_size (float, optional):
+                Maximum size of the fingerprint cache in MB, the least
+                recently used images being evicted after predict.
+                Defaults to None (no limit).
+            - single_pass (bool, optional):
+                Read each frame once, taking both the source data and the
+                amp input from it. Only valid if the trajectory and the
+                generated trajectory are the same file. Defaults to None
+                (enabled if both filenames point to the same file).
+            - metrics_filename (str, optional):
+                JSON file in which the errors of the amp data with respect
+                to the source data (see amp_metrics) are written by predict.
+                Defaults to None (not written).
+            - checkpoint_filename (str, optional):
+                JSON file in which the progress of the extraction is saved
+                every checkpoint_interval frames. If it exists, the
+                extraction is resumed from the last checkpoint. It enables
+                the stream mode. Defaults to None (no checkpoint).
+            - checkpoint_interval (int, optional):
+                Number of frames between two checkpoints. Defaults to 100.
+            - frames (slice, str, int or list, optional):
+                Frames of the trajectories to evaluate, as a slice, a string
+                like '100:2000:10' (ase syntax), a single index or a list of
+                indices. The other frames are skipped without being
+                evaluated. Defaults to None (all the frames).
+            - nb_random_frames (int, optional):
+                Number of frames drawn at random among the selected ones.
+                Defaults to None (no sampling).
+            - seed (int, optional):
+                Seed of the random sampling. Defaults to None.
+            - profile (bool, optional):
+                Time each phase of predict (see amp_profile) and write the
+                report with the logger. The frames are then evaluated by
+                blocks (of one frame if no batch_size is given), so that
+                the fingerprints and the network are timed separately.
+                Defaults to False.
+            - profile_filename (str, optional):
+                JSON file in which the profiling report is written. It
+                enables the profiling. Defaults to None (not written).
+            - profile_memory (bool, optional):
+                Also track the peak memory allocated during predict, with
+                tracemalloc. Defaults to False.
+            - evaluator (str, optional):
+                Either 'amp' (Amp calculator) or 'numpy' (NumpyAmp, see
+                amp_numpy), which evaluates the Gaussian fingerprints and
+                the neural network with NumPy, by blocks of batch_size
+                frames (NUMPY_BATCH_SIZE if not given), without ampdb
+                databases. Defaults to 'amp'.
+            - neighbor_skin (float, optional):
+                Skin of the cell list neighbor search of the numpy
+                evaluator (see amp_neighbors), in Angstrom. The neighbors of
+                a frame are reused for the next ones while no atom moved by
+                more than half the skin. Defaults to 0.0 (new search for
+                each frame).
+            - pipeline (bool, optional):
+                Run the decoding of the frames (reader processes), the
+                evaluation and the writing of the outfiles (writer thread)
+                concurrently, in stages connected by bounded queues (see
+                amp_pipeline). It enables the stream mode.
+                Defaults to False.
+            - queue_size (int, optional):
+                Number of blocks of frames waiting between two stages of the
+                pipeline. Defaults to 4.
         """
         self.amp_filename = amp_filename
+        self.view_indices = self.get_view_indices(
+            traj_filename, generated_traj_filename
+        )
+        if isinstance(traj_filename, TrajectoryView):
+            traj_filename = traj_filename.filename
+        if isinstance(generated_traj_filename, TrajectoryView):
+            generated_traj_filename = generated_traj_filename.filename
         self.traj_filename = traj_filename
         self.generated_traj_filename = generated_traj_filename
         self.amp_energies_outfilename = amp_energies_outfilename
         self.amp_forces_outfilename = amp_forces_outfilename
         self.src_energies_outfilename = src_energies_outfilename
         self.src_forces_outfilename = src_forces_outfilename
+        self.batch_size = batch_size
+        self.parallel = parallel
+        self.workers = workers
+        self.stream = stream
+        self.store_dirname = store_dirname
+        self.metrics_filename = metrics_filename
+        self.checkpoint_filename = checkpoint_filename
+        self.checkpoint_interval = checkpoint_interval
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+        self.write_stage = None
+        if checkpoint_filename is not None or pipeline:
+            self.stream = True
+        self.writers = {}
+        self.store_writers = {}
+        self.metrics = ErrorMetrics()
+        self.pending = {"src": deque(), "amp": deque()}
+        self.profile_filename = profile_filename
+        self.profiler = PhaseProfiler(
+            enabled=profile or profile_filename is not None, memory=profile_memory
+        )
 
         self.trajectory = []
         self.species = []
@@ -72,20 +637,155 @@ class Calc:
         self.src_forces = []
         self.amp_energies = []
         self.amp_forces = []
+        self.src_numbers = []
+        self.amp_numbers = []
 
         self.src_time_counter = 0
         self.src_nb_points = 0
+        self.amp_nb_points = 0
+
+        if single_pass is None:
+            single_pass = same_file(traj_filename, generated_traj_filename)
+        self.single_pass = single_pass
+
+        self.cache = None
+        self.dblabel = None
+        if cache_dir is not None:
+            self.cache = FingerprintCache(cache_dir, max_size=cache_size)
+            self.dblabel = self.cache.dblabel(self.amp_filename)
+
+        self.checkpoint = self.read_checkpoint()
+
+        # Metadata of the trajectory, if it is indexed (see amp_index)
+        trajectory_index = TrajectoryIndex.load(self.traj_filename)
+        if trajectory_index is not None:
+            self.species = trajectory_index.first_symbols
+
+        self.frame_indices = self.get_frame_indices(frames, nb_random_frames, seed)
+
+        if evaluator not in ("amp", "numpy"):
+            raise ValueError("Unknown evaluator {}".format(evaluator))
+        self.evaluator = evaluator
+        self.neighbor_skin = neighbor_skin
+        if evaluator == "numpy":
+            self.calc = NumpyAmp(self.amp_filename, skin=neighbor_skin)
+            if self.batch_size is None:
+                self.batch_size = NUMPY_BATCH_SIZE
+        else:
+            self.calc = Amp.load(self.amp_filename, dblabel=self.dblabel)
 
         self.read_trajectories()
 
-        self.calc = Amp.load(self.amp_filename)
+    def get_frame_indices(self, frames=None, nb_random_frames=None, seed=None):
+        """
+        Indices of the frames to evaluate (see select_frames). When resuming
+        from a checkpoint, the selection saved in the checkpoint is used.
+
+        Returns:
+            - np.ndarray: Sorted indices of the selected frames, or None if
+                all the frames are evaluated
+        """
+        if self.checkpoint is not None and "frames" in self.checkpoint:
+            return np.array(self.checkpoint["frames"], dtype=np.int64)
+        if self.view_indices is not None:
+            # The selection applies to the frames of the view
+            view_indices = np.unique(self.view_indices)
+            indices = view_indices[
+                select_frames(len(view_indices), frames, nb_random_frames, seed)
+            ]
+            print(
+                "evaluating {} of the {} frames of the view".format(
+                    len(indices), len(view_indices)
+                )
+            )
+            return indices
+        if frames is None and nb_random_frames is None:
+            return None
+        nb_frames = count_frames(self.traj_filename)
+        indices = select_frames(nb_frames, frames, nb_random_frames, seed)
+        print("evaluating {} of the {} frames".format(len(indices), nb_frames))
+        return indices
+
+    @staticmethod
+    def get_view_indices(traj_filename, generated_traj_filename):
+        """
+        Indices of the frames of the trajectory views given instead of
+        filenames. A view given for one trajectory applies to the other one.
+
+        Returns:
+            - np.ndarray: Indices of the frames of the views, or None if
+                no view is given
+        """
+        views = [
+            view
+            for view in (traj_filename, generated_traj_filename)
+            if isinstance(view, TrajectoryView)
+        ]
+        if not views:
+            return None
+        if len(views) == 2 and not np.array_equal(
+            views[0].indexes, views[1].indexes
+        ):
+            raise ValueError("Both trajectory views must have the same frames")
+        return views[0].indexes
 
     def read_trajectories(self):
         """
-        Read the corresponding trajectories using the ase.io iread method
+        Open the corresponding trajectories, see read_frames.
+        Only the selected frames are read. When resuming from a checkpoint,
+        the frames already extracted are skipped.
+        """
+        self.trajectory = self.open_frames(self.traj_filename)
+        if self.single_pass:
+            # The amp inputs are built from the source frames, the source
+            # data being extracted on the way
+            self.generated_trajectory = self.src_frames()
+        else:
+            self.generated_trajectory = self.paired_frames(
+                self.open_frames(self.generated_traj_filename)
+            )
+
+    def open_frames(self, filename):
+        """
+        Iterate over the frames of a trajectory to extract, i.e. the
+        selected frames not extracted before the checkpoint. With the
+        pipeline, the frames are decoded ahead in a reader process.
+        """
+        start = 0
+        if self.checkpoint is not None:
+            start = self.checkpoint["nb_frames"]
+        args = (filename, self.frame_indices, start)
+        if self.pipeline:
+            frames = prefetch(
+                read_frames, args, self.queue_size, self.batch_size or SHARD_SIZE
+            )
+        else:
+            frames = read_frames(*args)
+        return self.profiler.iterate("read", frames)
+
+    def src_frames(self):
+        """
+        Extract the source data of each frame of the trajectory, and yield
+        the frame once done
         """
-        self.trajectory = iread(self.traj_filename)
-        self.generated_trajectory = iread(self.generated_traj_filename)
+        for src_atoms in self.trajectory:
+            if not self.species:
+                self.species = src_atoms.get_chemical_symbols()
+            self.extract_src_data(src_atoms)
+            yield src_atoms
+
+    def paired_frames(self, generated_trajectory):
+        """
+        Yield the frames of the generated trajectory, extracting the source
+        data of the corresponding frame of the trajectory on the way, so
+        that both data sets are read in step
+        """
+        src_frames = self.src_frames()
+        for atoms in generated_trajectory:
+            next(src_frames, None)
+            yield atoms
+        for src_atoms in src_frames:
+            pass
 
     def extract_src_energies(self, atoms):
         """
@@ -115,42 +815,283 @@ class Calc:
         """
         Extract energies and forces for the source atom trajectory object
         """
-        self.extract_src_energies(atoms)
-        self.extract_src_forces(atoms)
-        self.src_nb_points = len(self.src_energies)
+        self.store_data(
+            "src",
+            [atoms.get_potential_energy()],
+            [atoms.get_forces()],
+            [atoms.get_atomic_numbers()],
+        )
 
     def extract_amp_data(self, atoms):
         """
         Extract energies and forces for the amp atom trajectory object
         """
-        self.extract_amp_energies(atoms)
-        self.extract_amp_forces(atoms)
-        self.amp_nb_points = len(self.amp_energies)
+        self.store_data(
+            "amp",
+            [atoms.get_potential_energy()],
+            [atoms.get_forces()],
+            [atoms.get_atomic_numbers()],
+        )
+
+    def extract_amp_batch(self, images):
+        """
+        Extract energies and forces for a block of amp atom objects,
+        evaluated at once by the amp calculator or by NumpyAmp
+        """
+        numbers = [atoms.get_atomic_numbers() for atoms in images]
+        if self.evaluator == "numpy":
+            with self.profiler.phase("fingerprint"):
+                block = self.calc.calculate_fingerprints(images)
+            with self.profiler.phase("network"):
+                energies, forces = self.calc.evaluate(block)
+        else:
+            with self.profiler.phase("fingerprint"):
+                keys = amp_fingerprints(self.calc, images)
+            self.touch_cache(images)
+            with self.profiler.phase("network"):
+                energies, forces = amp_evaluate(
+                    self.calc.model, self.calc.descriptor, keys
+                )
+        self.store_data("amp", energies, forces, numbers)
+
+    def touch_cache(self, images):
+        """
+        Mark the fingerprints of the given images as used in the cache
+        """
+        if self.cache is not None:
+            self.cache.touch(self.dblabel, [get_hash(atoms) for atoms in images])
+
+    def store_data(self, which, energies, forces, numbers):
+        """
+        Store the energies and forces of a block of frames for the given
+        type of data, ruled by the argument 'which'. The block is appended
+        to the in-memory lists, or written at once in the stream mode.
+        With the pipeline, the block is handed to the writer stage.
+
+        Args:
+            - which (str): Either 'src' or 'amp'
+            - energies (iterable): Energies of the frames
+            - forces (iterable): Forces of the frames
+            - numbers (iterable): Atomic numbers of the frames
+        """
+        if self.pipeline:
+            if self.write_stage is None:
+                # Started with the first block, after the reader processes
+                # and the pool of workers: no process is forked while the
+                # writer thread runs
+                self.start_pipeline()
+            self.write_stage.put((which, energies, forces, numbers))
+        else:
+            self.store_block(which, energies, forces, numbers)
+
+    def store_block(self, which, energies, forces, numbers):
+        """
+        Store a block of frames, see store_data
+        """
+        if which == "amp":
+            self.profiler.count(len(numbers), sum(len(frame) for frame in numbers))
+        if self.stream:
+            writer = self.writers[which]
+            with self.profiler.phase("write"):
+                writer.write(energies, forces)
+                if which in self.store_writers:
+                    self.store_writers[which].write(energies, forces, numbers)
+            nb_points = writer.nb_points
+            self.pending[which].extend(zip(energies, forces, numbers))
+            with self.profiler.phase("metrics"):
+                self.update_metrics()
+        else:
+            getattr(self, which + "_energies").extend(energies)
+            getattr(self, which + "_forces").extend(forces)
+            getattr(self, which + "_numbers").extend(numbers)
+            nb_points = len(getattr(self, which + "_energies"))
+        setattr(self, which + "_nb_points", nb_points)
+
+    def update_metrics(self):
+        """
+        Feed the metrics with the frames already stored for both the src and
+        amp data sets, in the stream mode
+        """
+        nb_pairs = min(len(self.pending["src"]), len(self.pending["amp"]))
+        if not nb_pairs:
+            return
+        src = [self.pending["src"].popleft() for _ in range(nb_pairs)]
+        amp = [self.pending["amp"].popleft() for _ in range(nb_pairs)]
+        src_energies, src_forces, numbers = zip(*src)
+        amp_energies, amp_forces, _ = zip(*amp)
+        self.metrics.update(src_energies, amp_energies, src_forces, amp_forces, numbers)
+
+        nb_frames = self.metrics.nb_frames
+        if (
+            self.checkpoint_filename is not None
+            and nb_frames - self.checkpoint["nb_frames"] >= self.checkpoint_interval
+        ):
+            self.write_checkpoint(nb_frames)
+        for writer in list(self.writers.values()) + list(self.store_writers.values()):
+            writer.forget(nb_frames)
+
+    def read_checkpoint(self):
+        """
+        Read the checkpoint file, if any
+
+        Returns:
+            - dict: The last checkpoint, or None if there is no checkpoint
+                file
+        """
+        if self.checkpoint_filename is None:
+            return None
+        if not os.path.isfile(self.checkpoint_filename):
+            return {"nb_frames": 0}
+        with open(self.checkpoint_filename) as infile:
+            checkpoint = json.load(infile)
+        print("resuming the extraction after {} frames".format(checkpoint["nb_frames"]))
+        return checkpoint
+
+    def write_checkpoint(self, nb_frames):
+        """
+        Flush the outfiles and save the state of the extraction after its
+        first nb_frames frames, i.e. the sizes of the outfiles and the state
+        of the metrics. Nothing is saved if a block of frames is not
+        complete at this point.
+
+        Args:
+            - nb_frames (int): Number of frames extracted for both the src
+                and amp data sets
+        """
+        states = {}
+        for name, writers in (
+            ("writers", self.writers),
+            ("store_writers", self.store_writers),
+        ):
+            states[name] = {
+                which: writer.get_state(nb_frames) for which, writer in writers.items()
+            }
+            if None in states[name].values():
+                return
+        for writer in list(self.writers.values()) + list(self.store_writers.values()):
+            writer.flush()
+        self.checkpoint = {
+            "nb_frames": nb_frames,
+            "metrics": self.metrics.get_state(),
+            **states,
+        }
+        if self.frame_indices is not None:
+            self.checkpoint["frames"] = self.frame_indices.tolist()
+        # Writing a new file before replacing the old one, so that a
+        # checkpoint is always available
+        with open(self.checkpoint_filename + ".tmp", "w") as outfile:
+            json.dump(self.checkpoint, outfile)
+        os.replace(self.checkpoint_filename + ".tmp", self.checkpoint_filename)
+
+    def get_metrics(self):
+        """
+        Errors of the amp data with respect to the source data, for the
+        frames extracted so far (see ErrorMetrics.summary). If a frame
+        selection is used, the indices of the evaluated frames are reported
+        under 'frames', and the frames of the maximum residuals are given as
+        indices in the trajectory.
+        """
+        summary = self.metrics.summary()
+        if self.frame_indices is None:
+            return summary
+        frames = self.frame_indices[: self.metrics.nb_frames]
+        for name in ("energy", "energy_per_atom", "force_norm_per_frame"):
+            index = summary[name]["max_frame"]
+            if index >= 0:
+                summary[name]["max_frame"] = int(frames[index])
+        summary["frames"] = frames.tolist()
+        return summary
+
+    def extract_amp_parallel(self):
+        """
+        Extract energies and forces for the generated trajectory with a pool
+        of processes. Each worker loads the amp calculator once. The blocks
+        are collected in submission order, so that the frame order is kept,
+        and only a few blocks per worker are in flight at the same time.
+        """
+        workers = self.workers or detect_workers()
+        print("predicting the amp data with {} workers".format(workers))
+        generated_atoms = map(self.amp_atoms, self.generated_trajectory)
+        shards = batches(generated_atoms, self.batch_size or SHARD_SIZE)
+        dbdir = tempfile.mkdtemp(prefix="amp-workers-")
+        try:
+            with multiprocessing.Pool(
+                workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.amp_filename,
+                    dbdir,
+                    self.dblabel,
+                    self.evaluator,
+                    self.neighbor_skin,
+                ),
+            ) as pool:
+                pending = deque()
+                for images in shards:
+                    numbers = [atoms.get_atomic_numbers() for atoms in images]
+                    self.touch_cache(images)
+                    result = pool.apply_async(_predict_shard, (images,))
+                    pending.append((result, numbers))
+                    if len(pending) >= 2 * workers:
+                        result, numbers = pending.popleft()
+                        with self.profiler.phase("workers"):
+                            energies, forces = result.get()
+                        self.store_data("amp", energies, forces, numbers)
+                while pending:
+                    result, numbers = pending.popleft()
+                    with self.profiler.phase("workers"):
+                        energies, forces = result.get()
+                    self.store_data("amp", energies, forces, numbers)
+        finally:
+            shutil.rmtree(dbdir, ignore_errors=True)
+
+    def amp_atoms(self, atoms):
+        """
+        Build the atom object given to the amp calculator from a generated
+        trajectory frame
+        """
+        return build_amp_atoms(atoms)
 
     def extract_data(self):
         """
         Extract data for src and amp sets. Launch extract_src_data and
-        extract_amp_data after reading each frame.
+        extract_amp_data after reading each frame. The source data are
+        extracted while iterating over the amp frames.
         """
-        # Extracting for src files
-        for src_atoms in self.trajectory:
-            if not self.species:
-                self.species = src_atoms.get_chemical_symbols()
-            self.extract_src_data(src_atoms)
-
         # Extracting for amp files
-        for atoms in self.generated_trajectory:
-            amp_atoms = Atoms(
-                symbols=atoms.get_chemical_symbols(),
-                positions=atoms.get_positions(),
-                calculator=self.calc,
-            )
-            self.extract_amp_data(amp_atoms)
+        if self.parallel:
+            self.extract_amp_parallel()
+        elif self.batch_size is None and not self.profiler.enabled:
+            for atoms in self.generated_trajectory:
+                amp_atoms = self.amp_atoms(atoms)
+                amp_atoms.calc = self.calc
+                self.touch_cache([amp_atoms])
+                self.extract_amp_data(amp_atoms)
+        else:
+            generated_atoms = map(self.amp_atoms, self.generated_trajectory)
+            for images in batches(generated_atoms, self.batch_size or 1):
+                self.extract_amp_batch(images)
+
+        if self.stream:
+            return
+
+        # Converting forces and atomic numbers into flat arrays with frame
+        # offsets, which handles frames of different sizes
+        self.src_forces = RaggedArray.from_frames(self.src_forces, np.float64, (3,))
+        self.amp_forces = RaggedArray.from_frames(self.amp_forces, np.float64, (3,))
+        self.src_numbers = RaggedArray.from_frames(self.src_numbers, np.int64)
+        self.amp_numbers = RaggedArray.from_frames(self.amp_numbers, np.int64)
 
-        # Converting forces into numpy array for handling information
-        # easely
-        self.src_forces = np.array(self.src_forces)
-        self.amp_forces = np.array(self.amp_forces)
+        # Computing the errors on the paired frames at once
+        nb_pairs = min(self.src_nb_points, self.amp_nb_points)
+        with self.profiler.phase("metrics"):
+            self.metrics.update(
+                self.src_energies[:nb_pairs],
+                self.amp_energies[:nb_pairs],
+                self.src_forces[:nb_pairs],
+                self.amp_forces[:nb_pairs],
+                self.src_numbers[:nb_pairs],
+            )
 
     def write_energies(self, which="src"):
         """
@@ -171,8 +1112,9 @@ class Calc:
             outfile = open(self.amp_energies_outfilename, "w")
             nb_points = self.amp_nb_points
             energies = self.amp_energies
-        for item in range(nb_points):
-            outfile.write("{0:>12} {1:>15.8f}\n".format(item + 1, energies[item]))
+        for start in range(0, nb_points, WRITE_CHUNK):
+            stop = min(start + WRITE_CHUNK, nb_points)
+            outfile.write(format_energies(energies[start:stop], start=start))
         outfile.close()
 
     def write_forces(self, which="src"):
@@ -196,17 +1138,9 @@ class Calc:
             forces = self.amp_forces
             nb_points = self.amp_nb_points
 
-        atom_counter = 0
-        for nb_traj in range(nb_points):
-            for atom_force in forces[nb_traj]:
-                outfile.write(
-                    "{0:>3} {1:>15.8f} {2:>15.8f} {3:>15.8f}\n".format(
-                        atom_counter + 1, atom_force[0], atom_force[1], atom_force[2]
-                    )
-                )
-                atom_counter += 1
-            atom_counter = 0
-            outfile.write("\n")
+        for start in range(0, nb_points, WRITE_CHUNK):
+            stop = min(start + WRITE_CHUNK, nb_points)
+            outfile.write(format_frames_forces(forces[start:stop]))
         outfile.close()
 
     def write_data(self, which="src"):
@@ -228,19 +1162,146 @@ class Calc:
         self.write_forces(which="src")
         self.write_energies(which="amp")
         self.write_forces(which="amp")
+        if self.store_dirname is not None:
+            self.write_store()
+
+    def write_store(self):
+        """
+        Write the energies, forces and atomic numbers of the src and amp
+        data in the binary result store
+        """
+        print("writing the result store {}".format(self.store_dirname))
+        for which in ("src", "amp"):
+            writer = StoreWriter(self.store_dirname, which)
+            writer.write(
+                getattr(self, which + "_energies"),
+                getattr(self, which + "_forces"),
+                getattr(self, which + "_numbers"),
+            )
+            writer.close()
 
     def predict(self):
         """
         Predict the energies according to the input files
         Launch the extract_data followed by the write_all_data methods.
+        In the stream mode, the outfiles are written during extract_data.
+        """
+        self.profiler.start()
+        if not self.stream:
+            self.extract_data()
+            with self.profiler.phase("write"):
+                self.write_all_data()
+        else:
+            self.open_writers()
+            try:
+                self.extract_data()
+            except BaseException:
+                # An error of the writer stage must not mask this one
+                self.stop_pipeline(raise_error=False)
+                raise
+            finally:
+                self.stop_pipeline()
+                self.close_writers()
+            if self.checkpoint_filename is not None:
+                # The extraction is complete
+                os.remove(self.checkpoint_filename)
+
+        if self.metrics_filename is not None:
+            print("writing the metrics in {}".format(self.metrics_filename))
+            with open(self.metrics_filename, "w") as outfile:
+                json.dump(self.get_metrics(), outfile, indent=4)
+
+        if self.cache is not None:
+            evicted = self.cache.evict()
+            if evicted:
+                print("{} images evicted from the fingerprint cache".format(evicted))
+
+        self.profiler.stop()
+        if self.profiler.enabled:
+            self.profiler.log(logger)
+            if self.profile_filename is not None:
+                print("writing the profiling report in {}".format(self.profile_filename))
+                self.profiler.write(self.profile_filename)
+
+    def get_profile(self):
+        """
+        Profiling report of predict (see PhaseProfiler.report), if the
+        profiling is enabled
+        """
+        return self.profiler.report()
+
+    def start_pipeline(self):
+        """
+        Start the writer stage of the pipeline: the blocks of results are
+        written while the next ones are evaluated. It is started with the
+        first block (see store_data), the reader processes (see
+        open_frames) being started when the trajectories are opened.
+        """
+        print("running the extraction as a pipeline")
+        self.write_stage = WriterStage(
+            lambda block: self.store_block(*block), 2 * self.queue_size
+        )
+
+    def stop_pipeline(self, raise_error: bool = True):
+        """
+        Wait for the blocks still in the writer stage, then stop it
+
+        Args:
+            - raise_error (bool, optional): Raise the error of the writer
+                stage. Defaults to True.
+        """
+        if self.write_stage is not None:
+            write_stage, self.write_stage = self.write_stage, None
+            write_stage.close(raise_error)
+
+    def open_writers(self):
+        """
+        Open the src and amp outfiles for the stream mode. When resuming
+        from a checkpoint, the outfiles and metrics are restored to their
+        state at the checkpoint.
+        """
+        print("streaming energies and forces to the src and amp files")
+        checkpoint = self.checkpoint or {}
+        writers = checkpoint.get("writers", {})
+        self.writers = {
+            "src": FrameWriter(
+                self.src_energies_outfilename,
+                self.src_forces_outfilename,
+                resume=writers.get("src"),
+            ),
+            "amp": FrameWriter(
+                self.amp_energies_outfilename,
+                self.amp_forces_outfilename,
+                resume=writers.get("amp"),
+            ),
+        }
+        if self.store_dirname is not None:
+            store_writers = checkpoint.get("store_writers", {})
+            self.store_writers = {
+                which: StoreWriter(
+                    self.store_dirname, which, resume=store_writers.get(which)
+                )
+                for which in ("src", "amp")
+            }
+        if "metrics" in checkpoint:
+            self.metrics.set_state(checkpoint["metrics"])
+        self.src_nb_points = self.writers["src"].nb_points
+        self.amp_nb_points = self.writers["amp"].nb_points
+
+    def close_writers(self):
+        """
+        Close the src and amp outfiles of the stream mode
         """
-        self.extract_data()
-        self.write_all_data()
+        for writer in list(self.writers.values()) + list(self.store_writers.values()):
+            writer.close()
+        self.writers = {}
+        self.store_writers = {}
 
     def clean(self, logfile=True):
         """
 
-        Clean the unwanted ampdb databases
+        Clean the unwanted ampdb databases. The databases of a fingerprint
+        cache are kept.
 
         Args:
             logfile (bool, optional): _description_. Defaults to True.
@@ -250,8 +1311,8 @@ class Calc:
             "amp-fingerprints.ampdb",
             "amp-neighborlists.ampdb",
         )
-        # Clean the directories
-        for dir in DIR_LIST:
+        # Clean the directories, unless they are kept in a cache
+        for dir in DIR_LIST if self.cache is None else ():
             try:
                 shutil.rmtree(dir)
             except OSError as e:
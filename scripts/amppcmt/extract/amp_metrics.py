@@ -0,0 +1,239 @@
+"""
+Module allowing to compute the errors of the neural network (amp) with
+respect to the source data, directly from the energies and forces extracted
+by Calc. The errors are accumulated block by block, so that they can be
+computed on the whole in-memory arrays at once or on the frames of the
+stream mode as they come. The following quantities are reported:
+    - energy residuals (RMSE, MAE and maximum residual)
+    - energy residuals per atom
+    - force residuals, for all the components, per component and per species
+    - force norm error per frame, i.e. the root mean square over the atoms
+        of the norm of the force residual
+"""
+
+# IMPORTATIONS
+
+import json
+import numpy as np
+from ase.data import chemical_symbols
+from .amp_store import RaggedArray
+
+# CONSTANTS
+
+COMPONENTS = ("x", "y", "z")
+
+# CLASSES
+
+
+class ResidualStats:
+    def __init__(self, shape: tuple = ()):
+        """
+        Streaming accumulator of the squared, absolute and maximum residuals
+
+        Args:
+            - shape (tuple, optional): Shape of one residual, e.g. (3,) for
+                force components. Defaults to () (scalar residuals).
+        """
+        self.count = 0
+        self.sum_sq = np.zeros(shape)
+        self.sum_abs = np.zeros(shape)
+        self.max_abs = np.zeros(shape)
+        self.max_index = np.full(shape, -1)
+
+    def update(self, residuals):
+        """
+        Add a block of residuals
+
+        Args:
+            - residuals (array_like): Residuals, shape (n,) + shape
+        """
+        residuals = np.asarray(residuals, dtype=float)
+        if not len(residuals):
+            return
+        abs_residuals = np.abs(residuals)
+        self.sum_sq += np.sum(residuals**2, axis=0)
+        self.sum_abs += np.sum(abs_residuals, axis=0)
+        block_max = np.max(abs_residuals, axis=0)
+        block_index = np.argmax(abs_residuals, axis=0) + self.count
+        self.max_index = np.where(block_max > self.max_abs, block_index, self.max_index)
+        self.max_abs = np.maximum(block_max, self.max_abs)
+        self.count += len(residuals)
+
+    def get_state(self):
+        """
+        State of the accumulator, as a JSON serializable dict
+        """
+        return {
+            "count": self.count,
+            "sum_sq": self.sum_sq.tolist(),
+            "sum_abs": self.sum_abs.tolist(),
+            "max_abs": self.max_abs.tolist(),
+            "max_index": self.max_index.tolist(),
+        }
+
+    def set_state(self, state):
+        """
+        Restore a state returned by get_state
+        """
+        self.count = state["count"]
+        self.sum_sq = np.array(state["sum_sq"], dtype=float)
+        self.sum_abs = np.array(state["sum_abs"], dtype=float)
+        self.max_abs = np.array(state["max_abs"], dtype=float)
+        self.max_index = np.array(state["max_index"], dtype=int)
+
+    def summary(self, index_name: str = None):
+        """
+        Root mean square, mean absolute and maximum residuals, over all the
+        components of the residuals
+
+        Args:
+            - index_name (str, optional): If given, the index of the maximum
+                residual is reported under this name. Defaults to None.
+
+        Returns:
+            - dict: rmse, mae and max values
+        """
+        size = max(self.count * self.sum_sq.size, 1)
+        summary = {
+            "rmse": float(np.sqrt(np.sum(self.sum_sq) / size)),
+            "mae": float(np.sum(self.sum_abs) / size),
+            "max": float(np.max(self.max_abs)),
+        }
+        if index_name is not None:
+            summary[index_name] = int(self.max_index.flat[np.argmax(self.max_abs)])
+        return summary
+
+    def component_summary(self, index: int):
+        """
+        Root mean square, mean absolute and maximum residuals of one
+        component
+        """
+        count = max(self.count, 1)
+        return {
+            "rmse": float(np.sqrt(self.sum_sq[index] / count)),
+            "mae": float(self.sum_abs[index] / count),
+            "max": float(self.max_abs[index]),
+        }
+
+
+class ErrorMetrics:
+    def __init__(self):
+        """
+        Errors of the amp energies and forces with respect to the source
+        ones, accumulated over blocks of paired frames
+        """
+        self.nb_frames = 0
+        self.nb_atoms = 0
+        self.energy = ResidualStats()
+        self.energy_per_atom = ResidualStats()
+        self.forces = ResidualStats((3,))
+        self.species = {}
+        self.force_norm = ResidualStats()
+
+    def update(self, src_energies, amp_energies, src_forces, amp_forces, numbers):
+        """
+        Add a block of frames
+
+        Args:
+            - src_energies (iterable): Source energies of the frames
+            - amp_energies (iterable): Amp energies of the frames
+            - src_forces (iterable): Source forces, one (n_atoms, 3) array
+                per frame, or a RaggedArray
+            - amp_forces (iterable): Amp forces, one (n_atoms, 3) array
+                per frame, or a RaggedArray
+            - numbers (iterable): Atomic numbers, one (n_atoms,) array per
+                frame, or a RaggedArray
+        """
+        energy_residuals = np.asarray(amp_energies, dtype=float) - np.asarray(
+            src_energies, dtype=float
+        )
+        if not len(energy_residuals):
+            return
+        numbers = RaggedArray.from_frames(numbers, np.int64)
+        nb_atoms = numbers.nb_rows()
+        numbers = numbers.data
+        force_residuals = (
+            RaggedArray.from_frames(amp_forces, np.float64, (3,)).data
+            - RaggedArray.from_frames(src_forces, np.float64, (3,)).data
+        )
+
+        self.energy.update(energy_residuals)
+        self.energy_per_atom.update(energy_residuals / nb_atoms)
+        self.forces.update(force_residuals)
+        for number in np.unique(numbers):
+            stats = self.species.setdefault(int(number), ResidualStats((3,)))
+            stats.update(force_residuals[numbers == number])
+        # Root mean square of the norm of the residual, frame by frame
+        starts = np.concatenate(([0], np.cumsum(nb_atoms)[:-1]))
+        squared_norms = np.sum(force_residuals**2, axis=1)
+        self.force_norm.update(
+            np.sqrt(np.add.reduceat(squared_norms, starts) / nb_atoms)
+        )
+
+        self.nb_frames += len(energy_residuals)
+        self.nb_atoms += len(numbers)
+
+    def get_state(self):
+        """
+        State of all the accumulators, as a JSON serializable dict, e.g. to
+        checkpoint an extraction
+        """
+        return {
+            "nb_frames": self.nb_frames,
+            "nb_atoms": self.nb_atoms,
+            "energy": self.energy.get_state(),
+            "energy_per_atom": self.energy_per_atom.get_state(),
+            "forces": self.forces.get_state(),
+            "species": {
+                str(number): stats.get_state() for number, stats in self.species.items()
+            },
+            "force_norm": self.force_norm.get_state(),
+        }
+
+    def set_state(self, state):
+        """
+        Restore a state returned by get_state
+        """
+        self.nb_frames = state["nb_frames"]
+        self.nb_atoms = state["nb_atoms"]
+        for name in ("energy", "energy_per_atom", "forces", "force_norm"):
+            getattr(self, name).set_state(state[name])
+        self.species = {}
+        for number, stats_state in state["species"].items():
+            self.species[int(number)] = ResidualStats((3,))
+            self.species[int(number)].set_state(stats_state)
+
+    def summary(self):
+        """
+        Summary of all the errors
+
+        Returns:
+            - dict: Errors, with energies in eV and forces in eV/A
+        """
+        return {
+            "nb_frames": self.nb_frames,
+            "nb_atoms": self.nb_atoms,
+            "energy": self.energy.summary(index_name="max_frame"),
+            "energy_per_atom": self.energy_per_atom.summary(index_name="max_frame"),
+            "forces": self.forces.summary(),
+            "forces_components": {
+                component: self.forces.component_summary(index)
+                for index, component in enumerate(COMPONENTS)
+            },
+            "forces_species": {
+                chemical_symbols[number]: stats.summary()
+                for number, stats in sorted(self.species.items())
+            },
+            "force_norm_per_frame": self.force_norm.summary(index_name="max_frame"),
+        }
+
+    def write(self, filename: str = "metrics.json"):
+        """
+        Write the summary of the errors in a JSON file
+
+        Args:
+            - filename (str, optional): Name of the JSON file.
+                Defaults to 'metrics.json'.
+        """
+        with open(filename, "w") as outfile:
+            json.dump(self.summary(), outfile, indent=4)
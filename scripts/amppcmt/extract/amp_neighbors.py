@@ -0,0 +1,233 @@
+"""
+Module allowing to build the neighbor lists of the Gaussian fingerprints with
+cell lists. The atoms are sorted into bins at least as wide as the cutoff
+radius, and the neighbors of an atom are only searched in the adjacent bins,
+so that the cost grows linearly with the number of atoms. Periodic boundary
+conditions are supported along any axis, including cells smaller than the
+cutoff radius. The neighbors are returned as CSR-style arrays:
+    - indptr: the neighbors of the atom i are the entries
+        indptr[i]:indptr[i + 1] of the following arrays, shape (n_atoms + 1,)
+    - indices: index of each neighbor, shape (n_pairs,)
+    - shifts: periodic image of each neighbor, as integer multiples of the
+        cell vectors, shape (n_pairs, 3)
+    - vectors: vector from the atom to its neighbor, shape (n_pairs, 3)
+    - distances: distance to the neighbor, shape (n_pairs,)
+With a skin, the candidate pairs are searched within cutoff + skin and reused
+for the next frames, as long as no atom moved by more than half the skin.
+"""
+
+# IMPORTATIONS
+
+import itertools
+import numpy as np
+from ase.cell import Cell
+
+# CONSTANTS
+
+# Maximum number of bins per atom, which bounds the memory used for small
+# cutoff radii
+MAX_BINS_PER_ATOM = 8
+
+# FUNCTIONS
+
+
+def cell_list_pairs(positions, cell, pbc, cutoff):
+    """
+    Find all the pairs of atoms closer than the cutoff radius with a cell
+    list, periodic images included
+
+    Args:
+        - positions (np.ndarray): Positions of the atoms, shape (n_atoms, 3)
+        - cell (np.ndarray): Cell vectors as rows, shape (3, 3). The vectors
+            of the non periodic axes may be zero.
+        - pbc (array_like): Periodic boundary conditions along each axis
+        - cutoff (float): Cutoff radius
+
+    Returns:
+        - first (np.ndarray): Index of the first atom of each pair
+        - second (np.ndarray): Index of the second atom of each pair
+        - shifts (np.ndarray): Periodic image of the second atom, shape
+            (n_pairs, 3). The vector of a pair is
+            positions[second] + shifts @ cell - positions[first].
+    """
+    positions = np.asarray(positions, dtype=float)
+    pbc = np.asarray(pbc, dtype=bool)
+    nb_atoms = len(positions)
+    cell = complete_cell(cell, pbc)
+
+    # Fractional coordinates, wrapped into the cell along the periodic axes
+    fractional = np.linalg.solve(cell.T, positions.T).T
+    wraps = np.where(pbc, np.floor(fractional), 0.0)
+    fractional -= wraps
+    wraps = wraps.astype(int)
+    wrapped = fractional @ cell
+
+    # Distance between the opposite faces of the cell along each axis
+    spacings = 1.0 / np.linalg.norm(np.linalg.inv(cell), axis=0)
+    origins = np.where(pbc, 0.0, fractional.min(axis=0, initial=0.0))
+    extents = np.where(pbc, 1.0, fractional.max(axis=0, initial=0.0) - origins)
+    nb_bins = np.maximum(1, (extents * spacings / cutoff).astype(int))
+    while np.prod(nb_bins) > MAX_BINS_PER_ATOM * max(nb_atoms, 1):
+        nb_bins = np.maximum(1, nb_bins // 2)
+    widths = np.where(extents > 0, extents, 1.0) / nb_bins
+    # Number of bins to search on each side along each axis, the non
+    # periodic axes having no bin beyond the atoms
+    reach = np.ceil(cutoff / (spacings * widths)).astype(int)
+    reach = np.where(pbc, reach, np.minimum(reach, nb_bins - 1))
+
+    bins = np.floor((fractional - origins) / widths).astype(int)
+    bins = np.clip(bins, 0, nb_bins - 1)
+    linear = np.ravel_multi_index(bins.T, nb_bins)
+    order = np.argsort(linear, kind="stable")
+    counts = np.bincount(linear, minlength=np.prod(nb_bins))
+    starts = np.cumsum(counts) - counts
+
+    first, second, shifts = [], [], []
+    atoms = np.arange(nb_atoms)
+    for offset in itertools.product(*[range(-r, r + 1) for r in reach]):
+        neighbor_bins = bins + offset
+        image = np.where(pbc, np.floor_divide(neighbor_bins, nb_bins), 0)
+        neighbor_bins -= image * nb_bins
+        valid = np.all((neighbor_bins >= 0) & (neighbor_bins < nb_bins), axis=1)
+        neighbor_linear = np.ravel_multi_index(
+            np.where(valid[:, None], neighbor_bins, 0).T, nb_bins
+        )
+        nb_candidates = np.where(valid, counts[neighbor_linear], 0)
+        total = nb_candidates.sum()
+        if not total:
+            continue
+        i = np.repeat(atoms, nb_candidates)
+        rank = np.arange(total) - np.repeat(
+            np.cumsum(nb_candidates) - nb_candidates, nb_candidates
+        )
+        j = order[np.repeat(starts[neighbor_linear], nb_candidates) + rank]
+        image = np.repeat(image, nb_candidates, axis=0)
+        vectors = wrapped[j] + image @ cell - wrapped[i]
+        keep = np.einsum("ij,ij->i", vectors, vectors) < cutoff**2
+        keep &= (i != j) | np.any(image != 0, axis=1)
+        first.append(i[keep])
+        second.append(j[keep])
+        # Image of the second atom with respect to the unwrapped positions
+        shifts.append(image[keep] - wraps[j[keep]] + wraps[i[keep]])
+
+    if not first:
+        return np.empty(0, int), np.empty(0, int), np.empty((0, 3), int)
+    return np.concatenate(first), np.concatenate(second), np.concatenate(shifts)
+
+
+def complete_cell(cell, pbc):
+    """
+    Cell used to bin the atoms. Without periodic axis, the cell is not used
+    and the cartesian axes are taken. Otherwise, the zero vectors of the non
+    periodic axes are replaced by unit vectors orthogonal to the others.
+
+    Returns:
+        - np.ndarray: Cell vectors as rows, shape (3, 3)
+    """
+    if not np.any(pbc):
+        return np.eye(3)
+    cell = Cell(np.array(cell, dtype=float).reshape(3, 3))
+    if np.any(np.asarray(pbc) & (cell.lengths() == 0.0)):
+        raise ValueError("Periodic axes need a non zero cell vector")
+    return np.array(cell.complete())
+
+
+# CLASSES
+
+
+class NeighborList:
+    def __init__(self, cutoff: float, skin: float = 0.0):
+        """
+        Neighbor list of the atoms of a frame, built with a cell list and
+        reused for the next frames when possible
+
+        Args:
+            - cutoff (float): Cutoff radius
+            - skin (float, optional): The candidate pairs are searched
+                within cutoff + skin, and reused as long as no atom moved by
+                more than skin / 2 since the last build. Defaults to 0.0
+                (new search for each frame).
+        """
+        self.cutoff = cutoff
+        self.skin = skin
+        self.nb_builds = 0
+        self.nb_updates = 0
+        self.reference = None
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int64)
+        self.shifts = np.empty((0, 3), dtype=np.int64)
+        self.vectors = np.empty((0, 3))
+        self.distances = np.empty(0)
+
+    def _reusable(self, positions, cell, pbc):
+        """
+        Check whether the candidate pairs of the last build are still valid
+        """
+        if self.reference is None or self.skin <= 0.0:
+            return False
+        ref_positions, ref_cell, ref_pbc = self.reference
+        if len(positions) != len(ref_positions):
+            return False
+        if not (np.array_equal(cell, ref_cell) and np.array_equal(pbc, ref_pbc)):
+            return False
+        if not len(positions):
+            return True
+        displacements = np.linalg.norm(positions - ref_positions, axis=1)
+        return displacements.max() <= 0.5 * self.skin
+
+    def update(self, atoms):
+        """
+        Compute the neighbors of the atoms of a frame
+
+        Args:
+            - atoms (ase.Atoms): The frame
+
+        Returns:
+            - bool: True if the candidate pairs were searched again, False
+                if the ones of a previous frame were reused
+        """
+        positions = atoms.get_positions()
+        cell = np.array(atoms.get_cell())
+        pbc = np.array(atoms.get_pbc())
+        rebuilt = not self._reusable(positions, cell, pbc)
+        if rebuilt:
+            self.candidates = cell_list_pairs(
+                positions, cell, pbc, self.cutoff + self.skin
+            )
+            self.reference = (positions, cell, pbc)
+            self.nb_builds += 1
+        self.nb_updates += 1
+
+        first, second, shifts = self.candidates
+        vectors = positions[second] + shifts @ cell - positions[first]
+        distances = np.linalg.norm(vectors, axis=1)
+        keep = distances < self.cutoff
+        first, second, shifts = first[keep], second[keep], shifts[keep]
+        vectors, distances = vectors[keep], distances[keep]
+
+        order = np.lexsort((second, first))
+        self.indptr = np.zeros(len(positions) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(first, minlength=len(positions)))
+        self.indices = second[order]
+        self.shifts = shifts[order]
+        self.vectors = vectors[order]
+        self.distances = distances[order]
+        return rebuilt
+
+    def get_centers(self):
+        """
+        Index of the center atom of each pair, i.e. the row indices of the
+        CSR arrays
+        """
+        return np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+
+    def get_neighbors(self, index):
+        """
+        Neighbors of one atom
+
+        Returns:
+            - indices (np.ndarray): Indices of the neighbors
+            - shifts (np.ndarray): Periodic images of the neighbors
+        """
+        start, stop = self.indptr[index], self.indptr[index + 1]
+        return self.indices[start:stop], self.shifts[start:stop]
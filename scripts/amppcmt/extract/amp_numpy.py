@@ -0,0 +1,601 @@
+"""
+Module allowing to evaluate a trained .amp file with NumPy only, without the
+Amp calculator stack (ampdb databases, logfiles, worker processes). The
+Gaussian descriptor parameters and the neural network weights are read from
+the .amp file, then the fingerprints, the energies and the analytic forces
+are computed with vectorized operations over all the atoms of a block of
+frames at once. The following parts of AMP are supported:
+    - descriptor: Gaussian, with G2, G4 and G5 symmetry functions and the
+        Cosine or Polynomial cutoff functions
+    - model: NeuralNetwork in the atom-centered mode, with the tanh, sigmoid
+        or linear activations
+The forces are not obtained from stored fingerprint derivatives, but by
+back-propagating the derivatives of the atomic energies with respect to the
+fingerprints onto the atom pairs and triplets.
+"""
+
+# IMPORTATIONS
+
+from collections import OrderedDict
+import numpy as np
+from ase.data import atomic_numbers
+from .amp_neighbors import NeighborList
+
+# CONSTANTS
+
+# Fingerprints whose range in the training set is below this value are not
+# scaled, as in AMP
+FPRANGE_TOLERANCE = 1e-8
+
+# FUNCTIONS
+
+
+def read_amp_file(amp_filename):
+    """
+    Read the descriptor and model parameters of an .amp file, as written by
+    AMP
+
+    Args:
+        - amp_filename (str): Filename for the amp calc object
+
+    Returns:
+        - descriptor (dict): Parameters of the descriptor
+        - model (dict): Parameters of the model
+    """
+    namespace = {
+        "__builtins__": {},
+        "dict": dict,
+        "array": np.array,
+        "OrderedDict": OrderedDict,
+    }
+    with open(amp_filename) as infile:
+        parameters = eval(infile.read(), namespace)
+    descriptor = eval(parameters["descriptor"], namespace)
+    model = eval(parameters["model"], namespace)
+    return descriptor, model
+
+
+def cutoff_function(cutoff, distances):
+    """
+    Values and derivatives of an AMP cutoff function
+
+    Args:
+        - cutoff (dict): Cutoff of the descriptor, e.g.
+            {'name': 'Cosine', 'kwargs': {'Rc': 6.5}}
+        - distances (np.ndarray): Distances
+
+    Returns:
+        - values (np.ndarray): Values of the cutoff function
+        - primes (np.ndarray): Derivatives with respect to the distances
+    """
+    Rc = cutoff["kwargs"]["Rc"]
+    inside = distances <= Rc
+    if cutoff["name"] == "Cosine":
+        values = 0.5 * (np.cos(np.pi * distances / Rc) + 1.0)
+        primes = -0.5 * np.pi / Rc * np.sin(np.pi * distances / Rc)
+    elif cutoff["name"] == "Polynomial":
+        gamma = cutoff["kwargs"].get("gamma", 4)
+        x = distances / Rc
+        values = 1.0 + gamma * x ** (gamma + 1) - (gamma + 1) * x**gamma
+        primes = (gamma * (gamma + 1) / Rc) * (x**gamma - x ** (gamma - 1))
+    else:
+        raise NotImplementedError(
+            "Unknown cutoff function {}".format(cutoff["name"])
+        )
+    return np.where(inside, values, 0.0), np.where(inside, primes, 0.0)
+
+
+def neighbor_pairs(images, neighborlist):
+    """
+    Neighbor pairs of all the atoms of a block of images, with the same
+    neighbors as the neighbor lists of AMP (all the atoms, periodic images
+    included, closer than the cutoff radius)
+
+    Args:
+        - images (list): List of ase.Atoms objects
+        - neighborlist (NeighborList): Cell list neighbor search, updated
+            frame after frame (see amp_neighbors)
+
+    Returns:
+        - centers (np.ndarray): Index of the center atom of each pair, in
+            the block, sorted
+        - neighbors (np.ndarray): Index of the neighbor atom of each pair
+        - vectors (np.ndarray): Vector from the center to the neighbor,
+            shape (n_pairs, 3)
+    """
+    centers = [np.empty(0, dtype=int)]
+    neighbors = [np.empty(0, dtype=int)]
+    vectors = [np.empty((0, 3))]
+    start = 0
+    for atoms in images:
+        neighborlist.update(atoms)
+        centers.append(neighborlist.get_centers() + start)
+        neighbors.append(neighborlist.indices + start)
+        vectors.append(neighborlist.vectors)
+        start += len(atoms)
+    return np.concatenate(centers), np.concatenate(neighbors), np.concatenate(vectors)
+
+
+def pair_triplets(centers):
+    """
+    Build the triplets (i, j, k) of an atom i and two of its neighbors,
+    each unordered pair of neighbors being counted once, as in AMP
+
+    Args:
+        - centers (np.ndarray): Sorted index of the center atom of each pair
+
+    Returns:
+        - first (np.ndarray): Index of the pair (i, j) of each triplet
+        - second (np.ndarray): Index of the pair (i, k) of each triplet
+    """
+    nb_pairs = len(centers)
+    # Index of the pair following the last pair of the same center atom
+    ends = np.searchsorted(centers, centers, side="right")
+    counts = ends - np.arange(nb_pairs) - 1
+    first = np.repeat(np.arange(nb_pairs), counts)
+    starts = np.cumsum(counts) - counts
+    second = first + 1 + np.arange(len(first)) - np.repeat(starts, counts)
+    return first, second
+
+
+def activate(activation, net):
+    """
+    Activation function of the nodes, and its derivative with respect to
+    the node input
+    """
+    if activation == "tanh":
+        output = np.tanh(net)
+        return output, 1.0 - output**2
+    if activation == "sigmoid":
+        output = 1.0 / (1.0 + np.exp(-net))
+        return output, output * (1.0 - output)
+    if activation == "linear":
+        return net, np.ones_like(net)
+    raise NotImplementedError("Unknown activation {}".format(activation))
+
+
+def compare_with_amp(amp_filename, images):
+    """
+    Compare the energies and forces of NumpyAmp with the ones of the Amp
+    calculator on a block of images
+
+    Args:
+        - amp_filename (str): Filename for the amp calc object
+        - images (list): List of ase.Atoms objects
+
+    Returns:
+        - dict: Maximum absolute differences of the energies (eV) and of
+            the force components (eV/A)
+    """
+    from amp import Amp
+    from .amp_extract import amp_predict
+
+    amp_energies, amp_forces = amp_predict(Amp.load(amp_filename), images)
+    energies, forces = NumpyAmp(amp_filename).predict(images)
+    return {
+        "energy": float(np.max(np.abs(energies - amp_energies), initial=0.0)),
+        "forces": float(
+            max(
+                (np.max(np.abs(f - g), initial=0.0) for f, g in zip(forces, amp_forces)),
+                default=0.0,
+            )
+        ),
+    }
+
+
+# CLASSES
+
+
+class FrameBlock:
+    def __init__(self, images, numbers, pairs, triplets):
+        """
+        Atoms and neighbors of a block of frames, with their fingerprints,
+        as returned by NumpyAmp.calculate_fingerprints
+
+        Args:
+            - images (list): List of ase.Atoms objects
+            - numbers (np.ndarray): Atomic numbers of all the atoms
+            - pairs (tuple): Centers, neighbors, vectors and distances of
+                the neighbor pairs
+            - triplets (tuple): Pair indices of the triplets
+        """
+        self.images = images
+        self.numbers = numbers
+        self.offsets = np.zeros(len(images) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(atoms) for atoms in images])
+        self.centers, self.neighbors, self.vectors, self.distances = pairs
+        self.first, self.second = triplets
+        # Fingerprints of the atoms of each element
+        self.fingerprints = {}
+
+
+class NumpyAmp:
+    def __init__(self, amp_filename: str, skin: float = 0.0):
+        """
+        Lightweight evaluator of a trained .amp file, giving the same
+        energies and forces as the Amp calculator
+
+        Args:
+            - amp_filename (str): Filename for the amp calc object
+            - skin (float, optional): Skin of the neighbor list (see
+                amp_neighbors). The neighbor search of a frame is reused
+                for the next ones while no atom moved by more than half the
+                skin. Defaults to 0.0 (new search for each frame).
+        """
+        self.amp_filename = amp_filename
+        descriptor, model = read_amp_file(amp_filename)
+        if not descriptor["importname"].endswith("gaussian.Gaussian"):
+            raise NotImplementedError(
+                "Only the Gaussian descriptor is supported, not {}".format(
+                    descriptor["importname"]
+                )
+            )
+        if not model["importname"].endswith("neuralnetwork.NeuralNetwork"):
+            raise NotImplementedError(
+                "Only the NeuralNetwork model is supported, not {}".format(
+                    model["importname"]
+                )
+            )
+        if model["mode"] != "atom-centered":
+            raise NotImplementedError("Only the atom-centered mode is supported")
+
+        self.cutoff = descriptor["cutoff"]
+        if not isinstance(self.cutoff, dict):
+            self.cutoff = {"name": "Cosine", "kwargs": {"Rc": self.cutoff}}
+        self.Rc = self.cutoff["kwargs"]["Rc"]
+        self.neighborlist = NeighborList(self.Rc, skin=skin)
+        self.elements = sorted(descriptor["Gs"])
+        self.activation = model["activation"]
+
+        self.Gs = {}
+        self.networks = {}
+        for element in self.elements:
+            self.Gs[element] = self._symmetry_functions(descriptor["Gs"][element])
+            weights = model["weights"][element]
+            fprange = np.array(model["fprange"][element], dtype=float).reshape(-1, 2)
+            width = fprange[:, 1] - fprange[:, 0]
+            scaled = width > FPRANGE_TOLERANCE
+            # The fingerprints are scaled to [-1, 1] as fpscale * G + fpshift
+            fpscale = np.where(scaled, 2.0 / np.where(scaled, width, 1.0), 1.0)
+            self.networks[element] = {
+                # Weights of each layer, the last row being the bias
+                "weights": [
+                    np.array(weights[layer], dtype=float)
+                    for layer in sorted(weights)
+                ],
+                "fpscale": fpscale,
+                "fpshift": np.where(scaled, -1.0 - fpscale * fprange[:, 0], 0.0),
+                "slope": model["scalings"][element]["slope"],
+                "intercept": model["scalings"][element]["intercept"],
+            }
+
+    def _symmetry_functions(self, Gs):
+        """
+        Group the symmetry functions of an element by type, as arrays of
+        parameters. The position of each function in the fingerprint is
+        kept under 'index'.
+        """
+        groups = {}
+        for index, G in enumerate(Gs):
+            if G["type"] == "G2":
+                group = groups.setdefault(
+                    "G2", {"index": [], "element": [], "eta": [], "offset": []}
+                )
+                group["element"].append(atomic_numbers[G["element"]])
+                group["offset"].append(G.get("offset", 0.0))
+            elif G["type"] in ("G4", "G5"):
+                group = groups.setdefault(
+                    G["type"],
+                    {"index": [], "elements": [], "eta": [], "gamma": [], "zeta": []},
+                )
+                group["elements"].append(
+                    sorted(atomic_numbers[element] for element in G["elements"])
+                )
+                group["gamma"].append(G["gamma"])
+                group["zeta"].append(G["zeta"])
+            else:
+                raise NotImplementedError(
+                    "Unknown symmetry function {}".format(G["type"])
+                )
+            group["index"].append(index)
+            group["eta"].append(G["eta"])
+        groups = {
+            name: {key: np.array(values) for key, values in group.items()}
+            for name, group in groups.items()
+        }
+        return {"size": len(Gs), **groups}
+
+    def calculate_fingerprints(self, images):
+        """
+        Compute the fingerprints of all the atoms of a block of images
+
+        Args:
+            - images (list): List of ase.Atoms objects
+
+        Returns:
+            - FrameBlock: The block, holding the fingerprints of the atoms
+                of each element
+        """
+        numbers = np.array(
+            [number for atoms in images for number in atoms.get_atomic_numbers()],
+            dtype=int,
+        )
+        centers, neighbors, vectors = neighbor_pairs(images, self.neighborlist)
+        distances = np.linalg.norm(vectors, axis=1)
+        block = FrameBlock(
+            images,
+            numbers,
+            (centers, neighbors, vectors, distances),
+            pair_triplets(centers),
+        )
+        block.fc, block.fc_prime = cutoff_function(self.cutoff, distances)
+        self._triplet_geometry(block)
+        for element in self.elements:
+            block.fingerprints[element] = self._fingerprints(block, element)
+        return block
+
+    def _triplet_geometry(self, block):
+        """
+        Angles and third distances of the triplets of a block
+        """
+        first, second = block.first, block.second
+        a = block.vectors[first]
+        b = block.vectors[second]
+        rij = block.distances[first]
+        rik = block.distances[second]
+        block.c = b - a
+        block.rjk = np.linalg.norm(block.c, axis=1)
+        block.cos = np.maximum(np.einsum("ij,ij->i", a, b) / rij / rik, -1.0)
+        block.fc_jk, block.fc_jk_prime = cutoff_function(self.cutoff, block.rjk)
+
+    def _fingerprints(self, block, element):
+        """
+        Fingerprints of the atoms of one element of a block
+
+        Returns:
+            - np.ndarray: Fingerprints, shape (n_atoms of the element, n_G)
+        """
+        atoms = np.flatnonzero(block.numbers == atomic_numbers[element])
+        Gs = self.Gs[element]
+        # Position of the atoms in the fingerprint array of the element
+        rows = np.full(len(block.numbers), -1)
+        rows[atoms] = np.arange(len(atoms))
+        fingerprints = np.zeros((len(atoms), Gs["size"]))
+
+        if "G2" in Gs:
+            pairs = np.flatnonzero(rows[block.centers] >= 0)
+            for G, terms, _ in self._G2_terms(block, Gs["G2"], pairs):
+                fingerprints[:, G] = np.bincount(
+                    rows[block.centers[pairs]], weights=terms, minlength=len(atoms)
+                )
+        for name in ("G4", "G5"):
+            if name not in Gs:
+                continue
+            triplets = np.flatnonzero(rows[block.centers[block.first]] >= 0)
+            for G, terms, _ in self._G4_terms(block, Gs[name], triplets, name):
+                fingerprints[:, G] = np.bincount(
+                    rows[block.centers[block.first[triplets]]],
+                    weights=terms,
+                    minlength=len(atoms),
+                )
+        return fingerprints
+
+    def _G2_terms(self, block, G2, pairs):
+        """
+        Yield, for each G2 function, its index in the fingerprint, the terms
+        of the pairs and their derivatives with respect to the distance
+        """
+        r = block.distances[pairs]
+        fc = block.fc[pairs]
+        fc_prime = block.fc_prime[pairs]
+        neighbor_numbers = block.numbers[block.neighbors[pairs]]
+        for G, element, eta, offset in zip(
+            G2["index"], G2["element"], G2["eta"], G2["offset"]
+        ):
+            gaussian = np.exp(-eta * (r - offset) ** 2 / self.Rc**2)
+            gaussian = np.where(neighbor_numbers == element, gaussian, 0.0)
+            terms = gaussian * fc
+            derivatives = gaussian * (fc_prime - 2.0 * eta * (r - offset) / self.Rc**2 * fc)
+            yield G, terms, derivatives
+
+    def _G4_terms(self, block, G4, triplets, name="G4", derivatives=False):
+        """
+        Yield, for each G4 (or G5) function, its index in the fingerprint,
+        the terms of the triplets and, if asked, the coefficients of their
+        derivatives along the vectors a = Rj - Ri, b = Rk - Ri and
+        c = Rk - Rj
+        """
+        first, second = block.first[triplets], block.second[triplets]
+        rij = block.distances[first]
+        rik = block.distances[second]
+        rjk = block.rjk[triplets]
+        cos = block.cos[triplets]
+        fc_ij, fc_ij_prime = block.fc[first], block.fc_prime[first]
+        fc_ik, fc_ik_prime = block.fc[second], block.fc_prime[second]
+        if name == "G4":
+            fc_jk, fc_jk_prime = block.fc_jk[triplets], block.fc_jk_prime[triplets]
+        else:
+            # The gaussian and the cutoff function of Rjk are omitted in G5
+            fc_jk, fc_jk_prime = np.ones_like(rjk), np.zeros_like(rjk)
+        nj = block.numbers[block.neighbors[first]]
+        nk = block.numbers[block.neighbors[second]]
+        low, high = np.minimum(nj, nk), np.maximum(nj, nk)
+        for G, elements, eta, gamma, zeta in zip(
+            G4["index"], G4["elements"], G4["eta"], G4["gamma"], G4["zeta"]
+        ):
+            match = (low == elements[0]) & (high == elements[1])
+            prefactor = 2.0 ** (1.0 - zeta)
+            base = 1.0 + gamma * cos
+            angular = base**zeta
+            squares = rij**2 + rik**2 + (rjk**2 if name == "G4" else 0.0)
+            gaussian = np.where(match, np.exp(-eta * squares / self.Rc**2), 0.0)
+            radial = gaussian * fc_ij * fc_ik * fc_jk
+            terms = prefactor * angular * radial
+            if not derivatives:
+                yield G, terms, None
+                continue
+            dangular = zeta * gamma * base ** (zeta - 1.0)
+            factor = 2.0 * eta / self.Rc**2
+            dradial_ij = gaussian * fc_ik * fc_jk * (fc_ij_prime - factor * rij * fc_ij)
+            dradial_ik = gaussian * fc_ij * fc_jk * (fc_ik_prime - factor * rik * fc_ik)
+            if name == "G4":
+                dradial_jk = gaussian * fc_ij * fc_ik * (fc_jk_prime - factor * rjk * fc_jk)
+            else:
+                dradial_jk = np.zeros_like(rjk)
+            # Coefficients of the derivatives with respect to Rj and Rk:
+            # d/dRj = A * a + C * b - D * c and d/dRk = B * b + C * a + D * c
+            coefficients = (
+                prefactor
+                * (angular * dradial_ij / rij - dangular * cos / rij**2 * radial),
+                prefactor
+                * (angular * dradial_ik / rik - dangular * cos / rik**2 * radial),
+                prefactor * dangular / (rij * rik) * radial,
+                prefactor * angular * dradial_jk / np.where(rjk > 0, rjk, 1.0),
+            )
+            yield G, terms, coefficients
+
+    def _network(self, element, fingerprints):
+        """
+        Atomic energies of the atoms of one element, and their derivatives
+        with respect to the fingerprints
+
+        Returns:
+            - energies (np.ndarray): Atomic energies, shape (n_atoms,)
+            - gradients (np.ndarray): Derivatives of the atomic energies
+                with respect to the fingerprints, shape (n_atoms, n_G)
+        """
+        network = self.networks[element]
+        inputs = fingerprints * network["fpscale"] + network["fpshift"]
+        derivatives = []
+        for weights in network["weights"]:
+            net = inputs @ weights[:-1] + weights[-1]
+            inputs, derivative = activate(self.activation, net)
+            derivatives.append(derivative)
+        energies = network["slope"] * inputs[:, 0] + network["intercept"]
+        # Back-propagation of the derivatives down to the fingerprints
+        gradients = np.full((len(fingerprints), 1), network["slope"])
+        for weights, derivative in zip(
+            reversed(network["weights"]), reversed(derivatives)
+        ):
+            gradients = (gradients * derivative) @ weights[:-1].T
+        return energies, gradients * network["fpscale"]
+
+    def evaluate(self, block):
+        """
+        Energies and forces of a block whose fingerprints are computed
+
+        Args:
+            - block (FrameBlock): Block returned by calculate_fingerprints
+
+        Returns:
+            - energies (np.ndarray): Energies of the images, shape (n_images,)
+            - forces (list): Forces of each image as (n_atoms, 3) arrays
+        """
+        nb_atoms = len(block.numbers)
+        atomic_energies = np.zeros(nb_atoms)
+        forces = np.zeros((nb_atoms, 3))
+        for element in self.elements:
+            atoms = np.flatnonzero(block.numbers == atomic_numbers[element])
+            if not len(atoms):
+                continue
+            energies, gradients = self._network(element, block.fingerprints[element])
+            atomic_energies[atoms] = energies
+            self._add_forces(block, element, atoms, gradients, forces)
+
+        frames = np.repeat(np.arange(len(block.images)), np.diff(block.offsets))
+        energies = np.bincount(
+            frames, weights=atomic_energies, minlength=len(block.images)
+        )
+        return energies, [
+            forces[start:stop]
+            for start, stop in zip(block.offsets[:-1], block.offsets[1:])
+        ]
+
+    def _add_forces(self, block, element, atoms, gradients, forces):
+        """
+        Add the forces coming from the atomic energies of the atoms of one
+        element, given the derivatives of these energies with respect to
+        their fingerprints
+        """
+        Gs = self.Gs[element]
+        rows = np.full(len(block.numbers), -1)
+        rows[atoms] = np.arange(len(atoms))
+
+        if "G2" in Gs:
+            pairs = np.flatnonzero(rows[block.centers] >= 0)
+            pair_rows = rows[block.centers[pairs]]
+            coefficients = np.zeros(len(pairs))
+            for G, _, derivatives in self._G2_terms(block, Gs["G2"], pairs):
+                coefficients += gradients[pair_rows, G] * derivatives
+            # dE/dRj = coefficient * (Rj - Ri) / rij, and the opposite on i
+            vectors = (coefficients / block.distances[pairs])[:, None] * block.vectors[pairs]
+            self._scatter(forces, block.neighbors[pairs], -vectors)
+            self._scatter(forces, block.centers[pairs], vectors)
+
+        for name in ("G4", "G5"):
+            if name not in Gs:
+                continue
+            triplets = np.flatnonzero(rows[block.centers[block.first]] >= 0)
+            triplet_rows = rows[block.centers[block.first[triplets]]]
+            total = np.zeros((4, len(triplets)))
+            for G, _, coefficients in self._G4_terms(
+                block, Gs[name], triplets, name, derivatives=True
+            ):
+                total += gradients[triplet_rows, G] * np.array(coefficients)
+            first, second = block.first[triplets], block.second[triplets]
+            a = block.vectors[first]
+            b = block.vectors[second]
+            c = block.c[triplets]
+            d_rj = total[0][:, None] * a + total[2][:, None] * b - total[3][:, None] * c
+            d_rk = total[1][:, None] * b + total[2][:, None] * a + total[3][:, None] * c
+            self._scatter(forces, block.neighbors[first], -d_rj)
+            self._scatter(forces, block.neighbors[second], -d_rk)
+            self._scatter(forces, block.centers[first], d_rj + d_rk)
+
+    @staticmethod
+    def _scatter(forces, indices, vectors):
+        """
+        Add vectors to the rows of the forces array, repeated indices being
+        summed
+        """
+        for axis in range(3):
+            forces[:, axis] += np.bincount(
+                indices, weights=vectors[:, axis], minlength=len(forces)
+            )
+
+    def predict(self, images):
+        """
+        Predict the energies and forces of a block of images, with the same
+        signature as amp_predict
+
+        Args:
+            - images (list): List of ase.Atoms objects
+
+        Returns:
+            - energies (np.ndarray): Energies of the images, shape (n_images,)
+            - forces (list): Forces of each image as (n_atoms, 3) arrays
+        """
+        return self.evaluate(self.calculate_fingerprints(images))
+
+    def get_fingerprints(self, images):
+        """
+        Fingerprints of each atom of each image, in the order of the atoms
+
+        Args:
+            - images (list): List of ase.Atoms objects
+
+        Returns:
+            - list: For each image, a list of (symbol, fingerprint) tuples,
+                as stored by the Gaussian descriptor of AMP
+        """
+        block = self.calculate_fingerprints(images)
+        fingerprints = [None] * len(block.numbers)
+        for element in self.elements:
+            atoms = np.flatnonzero(block.numbers == atomic_numbers[element])
+            for atom, fingerprint in zip(atoms, block.fingerprints[element]):
+                fingerprints[atom] = (element, fingerprint.tolist())
+        return [
+            fingerprints[start:stop]
+            for start, stop in zip(block.offsets[:-1], block.offsets[1:])
+        ]
+
@@ -0,0 +1,173 @@
+"""
+Module allowing to run the stages of Calc.predict concurrently. The stages
+are connected by bounded queues, so that the decoding of the next frames and
+the writing of the previous ones happen while the network evaluates the
+current block, the memory held by the queues staying bounded:
+    - prefetch: decodes the frames of a trajectory in a background process,
+        which runs in parallel with the evaluation
+    - WriterStage: formats and writes the blocks of results in a background
+        thread, the writes releasing the GIL
+The errors raised in a background stage are raised again in the main thread.
+Forking a process while a thread holds a lock can deadlock the child: the
+reader processes (and the pool of workers of Calc) must be started before
+the WriterStage thread.
+"""
+
+# IMPORTATIONS
+
+import queue
+import threading
+import multiprocessing
+
+# CONSTANTS
+
+# Number of seconds between two checks of the other side of a queue
+POLL_INTERVAL = 0.1
+
+# Marker of the end of the queue of a WriterStage
+_END = object()
+
+# FUNCTIONS
+
+
+def _produce(function, args, chunks, chunk_size):
+    """
+    Put the items of function(*args) in a queue by chunks, in a reader
+    process
+    """
+    try:
+        chunk = []
+        for item in function(*args):
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                chunks.put(chunk)
+                chunk = []
+        if chunk:
+            chunks.put(chunk)
+    except BaseException as error:
+        chunks.put(_Failure(error))
+        return
+    chunks.put(None)
+
+
+def prefetch(function, args=(), maxsize: int = 4, chunk_size: int = 1):
+    """
+    Iterate over the items of function(*args) produced in a background
+    process, at most maxsize chunks ahead of the consumer. The items are
+    pickled to be sent to the consumer, e.g. the ase.Atoms objects decoded
+    from a trajectory. The process is started at once, not at the first
+    iteration, so that it is forked before any background thread.
+
+    Args:
+        - function (callable): Module level function returning an iterable,
+            e.g. read_frames
+        - args (tuple, optional): Arguments of the function.
+            Defaults to ().
+        - maxsize (int, optional): Maximum number of chunks waiting in the
+            queue. Defaults to 4.
+        - chunk_size (int, optional): Number of items sent at once.
+            Defaults to 1.
+
+    Yields:
+        - The items of the iterable, in order
+    """
+    chunks = multiprocessing.Queue(maxsize=maxsize)
+    process = multiprocessing.Process(
+        target=_produce, args=(function, args, chunks, chunk_size), daemon=True
+    )
+    process.start()
+    return _consume(process, chunks)
+
+
+def _consume(process, chunks):
+    """
+    Iterate over the items sent by a reader process, see prefetch
+    """
+    try:
+        while True:
+            try:
+                chunk = chunks.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not process.is_alive() and chunks.empty():
+                    raise RuntimeError("the reader process stopped unexpectedly")
+                continue
+            if chunk is None:
+                return
+            if isinstance(chunk, _Failure):
+                raise chunk.error
+            yield from chunk
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+# CLASSES
+
+
+class _Failure:
+    def __init__(self, error):
+        """
+        Error raised in a reader process, sent through the queue
+        """
+        self.error = error
+
+
+class WriterStage:
+    def __init__(self, function, maxsize: int = 4):
+        """
+        Background thread calling a function on each item put in a bounded
+        queue, in order
+
+        Args:
+            - function (callable): Function called on each item
+            - maxsize (int, optional): Maximum number of items waiting in
+                the queue. Defaults to 4.
+        """
+        self.function = function
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                return
+            if self.error is not None:
+                # Draining the queue after a failure
+                continue
+            try:
+                self.function(item)
+            except BaseException as error:
+                self.error = error
+
+    def put(self, item):
+        """
+        Send an item to the background thread, waiting while the queue is
+        full. An error raised by a previous item is raised here.
+        """
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def close(self, raise_error: bool = True):
+        """
+        Wait until all the items are processed, then stop the thread. An
+        error raised by one of the items is raised here.
+
+        Args:
+            - raise_error (bool, optional): Raise the error of an item. Set
+                to False when closing on another error, not to mask it.
+                Defaults to True.
+        """
+        self.queue.put(_END)
+        self.thread.join()
+        if raise_error and self.error is not None:
+            raise self.error
@@ -0,0 +1,208 @@
+"""
+Module allowing to profile the extraction of Calc, phase by phase. The time
+spent in each of the following phases is accumulated:
+    - read: decoding of the frames of the trajectories (iread)
+    - fingerprint: computation of the AMP fingerprints and their derivatives
+    - network: evaluation of the neural network (energies and forces)
+    - workers: waiting for the results of the worker processes (parallel
+        mode, fingerprints and network together)
+    - metrics: update of the error metrics
+    - write: formatting and writing of the outfiles
+The time spent outside these phases is reported as 'other'. The numbers of
+frames and atoms evaluated per second and, optionally, the peak memory are
+reported too, in a JSON file or with a logger.
+"""
+
+# IMPORTATIONS
+
+import json
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+# CONSTANTS
+
+PHASES = ("read", "fingerprint", "network", "workers", "metrics", "write")
+
+# CLASSES
+
+
+class PhaseProfiler:
+    def __init__(self, enabled: bool = True, memory: bool = False):
+        """
+        Accumulate the time spent in each phase of an extraction
+
+        Args:
+            - enabled (bool, optional): If False, nothing is timed.
+                Defaults to True.
+            - memory (bool, optional): Track the peak memory allocated by
+                python and numpy with tracemalloc, which slows down the
+                allocations. Defaults to False.
+        """
+        self.enabled = enabled
+        self.memory = memory and enabled
+        self.times = {phase: 0.0 for phase in PHASES}
+        self.calls = {phase: 0 for phase in PHASES}
+        self.max_times = {phase: 0.0 for phase in PHASES}
+        self.nb_frames = 0
+        self.nb_atoms = 0
+        self.start_time = None
+        self.wall_time = 0.0
+        self.peak_memory = None
+
+    def start(self):
+        """
+        Start the wall clock, and the memory tracking if asked
+        """
+        if not self.enabled:
+            return
+        if self.memory:
+            tracemalloc.start()
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        """
+        Stop the wall clock, and the memory tracking if asked
+        """
+        if not self.enabled or self.start_time is None:
+            return
+        self.wall_time += time.perf_counter() - self.start_time
+        self.start_time = None
+        if self.memory:
+            _, self.peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    def add(self, phase, elapsed):
+        """
+        Add the duration of one call of a phase
+
+        Args:
+            - phase (str): Name of the phase
+            - elapsed (float): Duration in seconds
+        """
+        self.times[phase] += elapsed
+        self.calls[phase] += 1
+        self.max_times[phase] = max(self.max_times[phase], elapsed)
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        Time the enclosed block as a call of the given phase
+        """
+        if not self.enabled:
+            yield
+            return
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start_time)
+
+    def iterate(self, phase, iterable):
+        """
+        Iterate over an iterable, timing each next() call as a call of the
+        given phase, e.g. the decoding of the frames of an iread generator
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        end = object()
+        while True:
+            start_time = time.perf_counter()
+            item = next(iterator, end)
+            self.add(phase, time.perf_counter() - start_time)
+            if item is end:
+                return
+            yield item
+
+    def count(self, nb_frames, nb_atoms):
+        """
+        Count evaluated frames and atoms
+        """
+        self.nb_frames += nb_frames
+        self.nb_atoms += nb_atoms
+
+    def report(self):
+        """
+        Summary of the profiling
+
+        Returns:
+            - dict: Total time, time per frame and share of the wall time of
+                each phase, with the throughput and the peak memory
+        """
+        wall_time = self.wall_time
+        if self.start_time is not None:
+            wall_time += time.perf_counter() - self.start_time
+        nb_frames = max(self.nb_frames, 1)
+        phases = {}
+        for phase in PHASES + ("other",):
+            if phase == "other":
+                total = max(wall_time - sum(self.times.values()), 0.0)
+            elif self.calls[phase]:
+                total = self.times[phase]
+            else:
+                continue
+            phases[phase] = {
+                "total_s": total,
+                "per_frame_ms": 1e3 * total / nb_frames,
+                "fraction": total / wall_time if wall_time else 0.0,
+            }
+            if phase != "other":
+                phases[phase]["calls"] = self.calls[phase]
+                phases[phase]["max_call_ms"] = 1e3 * self.max_times[phase]
+        report = {
+            "wall_time_s": wall_time,
+            "nb_frames": self.nb_frames,
+            "nb_atoms": self.nb_atoms,
+            "frames_per_second": self.nb_frames / wall_time if wall_time else 0.0,
+            "atoms_per_second": self.nb_atoms / wall_time if wall_time else 0.0,
+            "phases": phases,
+            # Peak resident set size of the process, in kB on Linux
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+        if self.peak_memory is not None:
+            report["peak_traced_memory_mb"] = self.peak_memory / 1e6
+        return report
+
+    def write(self, filename: str = "profile.json"):
+        """
+        Write the report in a JSON file
+
+        Args:
+            - filename (str, optional): Name of the JSON file.
+                Defaults to 'profile.json'.
+        """
+        with open(filename, "w") as outfile:
+            json.dump(self.report(), outfile, indent=4)
+
+    def log(self, logger):
+        """
+        Write the report with a logger, one line per phase
+
+        Args:
+            - logger (logging.Logger): Logger used, at the debug level
+        """
+        report = self.report()
+        logger.debug(
+            "Extraction of {} frames ({} atoms) took {:.4f} seconds: "
+            "{:.2f} frames/s, {:.2f} atoms/s".format(
+                report["nb_frames"],
+                report["nb_atoms"],
+                report["wall_time_s"],
+                report["frames_per_second"],
+                report["atoms_per_second"],
+            )
+        )
+        for phase, times in report["phases"].items():
+            logger.debug(
+                "Phase {} took {:.4f} seconds ({:.4f} ms per frame, {:.1%})".format(
+                    phase, times["total_s"], times["per_frame_ms"], times["fraction"]
+                )
+            )
+        logger.debug("Peak resident memory: {} kB".format(report["max_rss_kb"]))
+        if "peak_traced_memory_mb" in report:
+            logger.debug(
+                "Peak traced memory: {:.2f} MB".format(report["peak_traced_memory_mb"])
+            )
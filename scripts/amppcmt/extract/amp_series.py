@@ -0,0 +1,203 @@
+"""
+Module allowing to evaluate a series of AMP parameter files (e.g. the
+checkpoints written during a training) on the same trajectory in one pass.
+The fingerprints of each image are computed once for all the parameter files
+sharing the same descriptor, and every network is evaluated on them. The
+errors of each parameter file are written in two files:
+    - checkpoints_metrics.json: full summary of the errors (see amp_metrics)
+    - checkpoints_metrics.dat: one line per parameter file with the energy
+        and force RMSE, MAE and maximum residuals
+"""
+
+# IMPORTATIONS
+
+import os
+import glob
+import json
+import shutil
+import tempfile
+from ase.io import iread
+from amp import Amp
+from .amp_extract import (
+    SHARD_SIZE,
+    amp_evaluate,
+    amp_fingerprints,
+    batches,
+    build_amp_atoms,
+)
+from .amp_cache import FingerprintCache, read_descriptor
+from .amp_metrics import ErrorMetrics
+
+# FUNCTIONS
+
+
+def checkpoint_key(filename):
+    """
+    Sorting key of the parameter files. Files named after a training step
+    (e.g. 100.amp, 200.amp) are sorted numerically.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if stem.isdigit():
+        return (0, int(stem), filename)
+    return (1, 0, filename)
+
+
+# CLASSES
+
+
+class CheckpointSeries:
+    def __init__(
+        self,
+        amp_filenames,
+        traj_filename: str,
+        batch_size: int = SHARD_SIZE,
+        cache_dir: str = None,
+        cache_size: float = None,
+        metrics_filename: str = "checkpoints_metrics.json",
+        table_filename: str = "checkpoints_metrics.dat",
+    ):
+        """
+        Class allowing to evaluate several amp parameter files on the same
+        trajectory, computing the fingerprints of each image once.
+
+        Args:
+            - amp_filenames (list or str): Filenames of the amp calc
+                objects, or a glob pattern (e.g. 'amp-checkpoints/*.amp')
+            - traj_filename (str): Filename for the trajectory, holding the
+                source energies and forces
+            - batch_size (int, optional): Number of frames fingerprinted at
+                once. Defaults to SHARD_SIZE.
+            - cache_dir (str, optional): Directory of a persistent
+                fingerprint cache (see amp_cache). Defaults to None
+                (temporary databases, removed after the evaluation).
+            - cache_size (float, optional): Maximum size of the fingerprint
+                cache in MB. Defaults to None (no limit).
+            - metrics_filename (str, optional): JSON outfile of the errors.
+                Defaults to 'checkpoints_metrics.json'.
+            - table_filename (str, optional): Outfile of the error table.
+                Defaults to 'checkpoints_metrics.dat'.
+        """
+        if isinstance(amp_filenames, str):
+            amp_filenames = glob.glob(amp_filenames)
+        self.amp_filenames = sorted(amp_filenames, key=checkpoint_key)
+        self.traj_filename = traj_filename
+        self.batch_size = batch_size
+        self.metrics_filename = metrics_filename
+        self.table_filename = table_filename
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = FingerprintCache(cache_dir, max_size=cache_size)
+
+        # Grouping the parameter files sharing the same descriptor
+        groups = {}
+        for amp_filename in self.amp_filenames:
+            groups.setdefault(read_descriptor(amp_filename), []).append(amp_filename)
+        self.groups = list(groups.values())
+        print(
+            "{} parameter files, {} descriptor(s)".format(
+                len(self.amp_filenames), len(self.groups)
+            )
+        )
+
+        self.metrics = {
+            amp_filename: ErrorMetrics() for amp_filename in self.amp_filenames
+        }
+
+    def load_calcs(self, dbdir):
+        """
+        Load the amp calc objects. The calcs of a group share the databases
+        of the first one, whose labels are kept in self.dblabels.
+
+        Args:
+            - dbdir (str): Directory of the databases if no cache is used
+
+        Returns:
+            - dict: amp filename -> Amp calculator
+        """
+        calcs = {}
+        self.dblabels = []
+        for index, group in enumerate(self.groups):
+            if self.cache is not None:
+                dblabel = self.cache.dblabel(group[0])
+            else:
+                dblabel = os.path.join(dbdir, "amp-{}".format(index))
+            self.dblabels.append(dblabel)
+            for amp_filename in group:
+                calcs[amp_filename] = Amp.load(amp_filename, dblabel=dblabel)
+        return calcs
+
+    def evaluate(self):
+        """
+        Evaluate all the parameter files on the trajectory, block by block,
+        then write the errors
+        """
+        dbdir = tempfile.mkdtemp(prefix="amp-series-")
+        try:
+            calcs = self.load_calcs(dbdir)
+            for frames in batches(iread(self.traj_filename), self.batch_size):
+                images = [build_amp_atoms(atoms) for atoms in frames]
+                src_energies = [atoms.get_potential_energy() for atoms in frames]
+                src_forces = [atoms.get_forces() for atoms in frames]
+                numbers = [atoms.get_atomic_numbers() for atoms in frames]
+                for group, dblabel in zip(self.groups, self.dblabels):
+                    reference = calcs[group[0]]
+                    keys = amp_fingerprints(reference, images)
+                    if self.cache is not None:
+                        self.cache.touch(dblabel, keys)
+                    for amp_filename in group:
+                        energies, forces = amp_evaluate(
+                            calcs[amp_filename].model, reference.descriptor, keys
+                        )
+                        self.metrics[amp_filename].update(
+                            src_energies, energies, src_forces, forces, numbers
+                        )
+        finally:
+            shutil.rmtree(dbdir, ignore_errors=True)
+
+        if self.cache is not None:
+            self.cache.evict()
+        self.write_metrics()
+
+    def write_metrics(self):
+        """
+        Write the errors of each parameter file in the JSON and table
+        outfiles
+        """
+        summaries = {
+            amp_filename: self.metrics[amp_filename].summary()
+            for amp_filename in self.amp_filenames
+        }
+        print("writing the metrics in {}".format(self.metrics_filename))
+        with open(self.metrics_filename, "w") as outfile:
+            json.dump(summaries, outfile, indent=4)
+
+        print("writing the metrics table in {}".format(self.table_filename))
+        with open(self.table_filename, "w") as outfile:
+            outfile.write(
+                "#{0:>11} {1:>15} {2:>15} {3:>15} {4:>15} {5:>15} {6:>15} {7}\n".format(
+                    "checkpoint",
+                    "energy_rmse",
+                    "energy_mae",
+                    "energy_max",
+                    "force_rmse",
+                    "force_mae",
+                    "force_max",
+                    "amp_filename",
+                )
+            )
+            for index, amp_filename in enumerate(self.amp_filenames):
+                energy = summaries[amp_filename]["energy"]
+                forces = summaries[amp_filename]["forces"]
+                outfile.write(
+                    "{0:>12} {1:>15.8f} {2:>15.8f} {3:>15.8f} {4:>15.8f} "
+                    "{5:>15.8f} {6:>15.8f} {7}\n".format(
+                        index + 1,
+                        energy["rmse"],
+                        energy["mae"],
+                        energy["max"],
+                        forces["rmse"],
+                        forces["mae"],
+                        forces["max"],
+                        amp_filename,
+                    )
+                )
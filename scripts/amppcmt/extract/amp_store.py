@@ -0,0 +1,320 @@
+"""
+Module allowing to store the results of Calc in a binary format, alongside
+the aenet like .dat files. For each data set (src or amp), four .npy files
+are written in the store directory:
+    - [which]_energies.npy: energies, float64 array of shape (n_frames,)
+    - [which]_forces.npy: forces of all the atoms, float64 array of shape
+        (n_atoms_total, 3)
+    - [which]_offsets.npy: index of the first atom of each frame in the
+        forces array, int64 array of shape (n_frames + 1,)
+    - [which]_numbers.npy: atomic number of each atom, uint8 array of shape
+        (n_atoms_total,)
+The arrays are contiguous and can be opened as memory maps with ResultStore,
+without reading nor copying them.
+"""
+
+# IMPORTATIONS
+
+import os
+import numpy as np
+
+# CONSTANTS
+
+# Size of the .npy header reserved by NpyAppender, in bytes
+HEADER_SIZE = 128
+
+# FUNCTIONS
+
+
+def npy_header(dtype, shape):
+    """
+    Build a .npy (version 1.0) header of HEADER_SIZE bytes
+
+    Args:
+        - dtype (np.dtype): Data type of the array
+        - shape (tuple): Shape of the array
+
+    Returns:
+        - bytes: The header
+    """
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(
+        np.dtype(dtype).str, tuple(shape)
+    )
+    header = header.ljust(HEADER_SIZE - 10 - 1) + "\n"
+    return (
+        b"\x93NUMPY\x01\x00"
+        + np.uint16(len(header)).tobytes()
+        + header.encode("latin1")
+    )
+
+
+# CLASSES
+
+
+class RaggedArray:
+    def __init__(self, data, offsets):
+        """
+        Frames of variable sizes stored in one contiguous array. The rows of
+        the frame i are data[offsets[i]:offsets[i + 1]].
+
+        Args:
+            - data (np.ndarray): Rows of all the frames, e.g. the forces of
+                all the atoms with shape (n_atoms_total, 3)
+            - offsets (np.ndarray): Index of the first row of each frame,
+                shape (n_frames + 1,)
+        """
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_frames(cls, frames, dtype=np.float64, row_shape: tuple = ()):
+        """
+        Build a RaggedArray from a sequence of per-frame arrays
+
+        Args:
+            - frames (iterable): Arrays of the frames. A RaggedArray is
+                returned as it is.
+            - dtype (np.dtype, optional): Data type. Defaults to np.float64.
+            - row_shape (tuple, optional): Shape of one row, used when there
+                is no frame. Defaults to ().
+
+        Returns:
+            - RaggedArray: The frames
+        """
+        if isinstance(frames, cls):
+            return frames
+        frames = [np.asarray(frame, dtype=dtype) for frame in frames]
+        offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(frame) for frame in frames])
+        if frames:
+            data = np.concatenate(frames)
+        else:
+            data = np.empty((0,) + tuple(row_shape), dtype=dtype)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("RaggedArray slices must be contiguous")
+            stop = max(start, stop)
+            offsets = self.offsets[start : stop + 1]
+            return RaggedArray(self.data[offsets[0] : offsets[-1]], offsets - offsets[0])
+        if index < 0:
+            index += len(self)
+        return self.data[self.offsets[index] : self.offsets[index + 1]]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def nb_rows(self):
+        """
+        Number of rows (e.g. atoms) of each frame
+        """
+        return np.diff(self.offsets)
+
+    def is_uniform(self):
+        """
+        Check whether all the frames have the same number of rows
+        """
+        nb_rows = self.nb_rows()
+        return len(nb_rows) > 0 and np.all(nb_rows == nb_rows[0])
+
+    def to_uniform(self):
+        """
+        View of the frames as one array of shape (n_frames, n_rows, ...),
+        only valid if is_uniform()
+        """
+        return self.data.reshape((len(self), -1) + self.data.shape[1:])
+
+
+class NpyAppender:
+    def __init__(
+        self, filename: str, dtype, row_shape: tuple = (), nb_rows: int = None
+    ):
+        """
+        Write a .npy file row by row, without knowing its final length.
+        A fixed-size header is reserved at the beginning of the file and
+        filled with the final shape on close.
+
+        Args:
+            - filename (str): Name of the .npy file
+            - dtype (np.dtype): Data type of the array
+            - row_shape (tuple, optional): Shape of one row. Defaults to ().
+            - nb_rows (int, optional): If given, the existing file is
+                truncated to its first nb_rows rows and completed.
+                Defaults to None (new file).
+        """
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        if nb_rows is None:
+            self.nb_rows = 0
+            self.file = open(filename, "wb")
+            self.file.write(npy_header(self.dtype, (0,) + self.row_shape))
+        else:
+            row_size = self.dtype.itemsize * int(np.prod(self.row_shape))
+            os.truncate(filename, HEADER_SIZE + nb_rows * row_size)
+            self.nb_rows = nb_rows
+            self.file = open(filename, "r+b")
+            self.file.seek(0, os.SEEK_END)
+
+    def write(self, rows):
+        """
+        Append rows at the end of the array
+
+        Args:
+            - rows (array_like): Rows to append, shape (n_rows,) + row_shape
+        """
+        rows = np.ascontiguousarray(rows, dtype=self.dtype).reshape(
+            (-1,) + self.row_shape
+        )
+        self.file.write(rows.tobytes())
+        self.nb_rows += len(rows)
+
+    def flush(self):
+        """
+        Flush the written rows to the file
+        """
+        self.file.flush()
+
+    def close(self):
+        """
+        Write the final shape in the header and close the file
+        """
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, (self.nb_rows,) + self.row_shape))
+        self.file.close()
+
+
+class StoreWriter:
+    def __init__(self, dirname: str, which: str = "src", resume: dict = None):
+        """
+        Incremental writer of one data set (src or amp) of a result store
+
+        Args:
+            - dirname (str): Name of the store directory
+            - which (str, optional): Data set written. Defaults to 'src'.
+            - resume (dict, optional): State returned by get_state at a
+                checkpoint. The files are truncated to this state and
+                completed. Defaults to None (new store).
+        """
+        os.makedirs(dirname, exist_ok=True)
+        prefix = os.path.join(dirname, which)
+        if resume is None:
+            self.nb_points = 0
+            self.nb_atoms = 0
+            nb_frames = nb_atoms = nb_offsets = None
+        else:
+            self.nb_points = resume["nb_points"]
+            self.nb_atoms = resume["nb_atoms"]
+            nb_frames, nb_atoms = self.nb_points, self.nb_atoms
+            nb_offsets = self.nb_points + 1
+        self.energies = NpyAppender(prefix + "_energies.npy", np.float64, (), nb_frames)
+        self.forces = NpyAppender(prefix + "_forces.npy", np.float64, (3,), nb_atoms)
+        self.offsets = NpyAppender(prefix + "_offsets.npy", np.int64, (), nb_offsets)
+        self.numbers = NpyAppender(prefix + "_numbers.npy", np.uint8, (), nb_atoms)
+        if resume is None:
+            self.offsets.write([0])
+        self.states = {self.nb_points: self.nb_atoms}
+
+    def write(self, energies, forces, numbers):
+        """
+        Write a block of frames
+
+        Args:
+            - energies (iterable): Energies of the frames
+            - forces (iterable): Forces of the frames, one (n_atoms, 3)
+                array per frame
+            - numbers (iterable): Atomic numbers of the frames, one
+                (n_atoms,) array per frame
+        """
+        energies = list(energies)
+        forces = RaggedArray.from_frames(forces, np.float64, (3,))
+        numbers = RaggedArray.from_frames(numbers, np.uint8)
+        self.energies.write(energies)
+        self.forces.write(forces.data)
+        self.numbers.write(numbers.data)
+        self.offsets.write(numbers.offsets[1:] + self.nb_atoms)
+        self.nb_atoms += len(numbers.data)
+        self.nb_points += len(energies)
+        self.states[self.nb_points] = self.nb_atoms
+
+    def get_state(self, nb_points):
+        """
+        State of the store after its first nb_points frames, or None if
+        this number does not end a written block
+
+        Returns:
+            - dict: Numbers of frames and atoms
+        """
+        if nb_points not in self.states:
+            return None
+        return {"nb_points": nb_points, "nb_atoms": self.states[nb_points]}
+
+    def forget(self, nb_points):
+        """
+        Drop the states of the blocks ending before nb_points frames
+        """
+        for key in [key for key in self.states if key < nb_points]:
+            del self.states[key]
+
+    def flush(self):
+        """
+        Flush the .npy files
+        """
+        for appender in (self.energies, self.forces, self.offsets, self.numbers):
+            appender.flush()
+
+    def close(self):
+        """
+        Finalize the .npy files
+        """
+        for appender in (self.energies, self.forces, self.offsets, self.numbers):
+            appender.close()
+
+
+class ResultStore:
+    def __init__(self, dirname: str, which: str = "amp", mmap_mode: str = "r"):
+        """
+        Read one data set (src or amp) of a result store. The arrays are
+        memory mapped, nothing is read before being accessed.
+
+        Args:
+            - dirname (str): Name of the store directory
+            - which (str, optional): Data set read. Defaults to 'amp'.
+            - mmap_mode (str, optional): Memory map mode given to np.load.
+                Defaults to 'r'.
+        """
+        prefix = os.path.join(dirname, which)
+        self.energies = np.load(prefix + "_energies.npy", mmap_mode=mmap_mode)
+        self.forces = np.load(prefix + "_forces.npy", mmap_mode=mmap_mode)
+        self.offsets = np.load(prefix + "_offsets.npy", mmap_mode=mmap_mode)
+        self.numbers = np.load(prefix + "_numbers.npy", mmap_mode=mmap_mode)
+        self.ragged_forces = RaggedArray(self.forces, self.offsets)
+        self.ragged_numbers = RaggedArray(self.numbers, self.offsets)
+
+    def __len__(self):
+        return len(self.energies)
+
+    def get_forces(self, index):
+        """
+        Forces of one frame, as a view on the forces array
+        """
+        return self.forces[self.offsets[index] : self.offsets[index + 1]]
+
+    def get_numbers(self, index):
+        """
+        Atomic numbers of one frame, as a view on the numbers array
+        """
+        return self.numbers[self.offsets[index] : self.offsets[index + 1]]
+
+    def get_nb_atoms(self):
+        """
+        Number of atoms of each frame
+        """
+        return np.diff(self.offsets)
@@ -3,6 +3,9 @@ from amp.descriptor.gaussian import Gaussian
 from amp.model.neuralnetwork import NeuralNetwork
 from jinja2 import Template
 import pkg_resources
+import numpy as np
+from ..split.amp_index import TrajectoryIndex
+from ..split.amp_manifest import read_manifest
 
 class Launch():
     
@@ -23,7 +26,8 @@ class Launch():
             None,
         initial_calc:bool = True,
         test:bool = False,
-        filename:str = 'amp_launch.py'):
+        filename:str = 'amp_launch.py',
+        subset:str = 'train'):
         """
         
         Class to generate amp-atomistics inputs from jinja2 templates
@@ -50,6 +54,11 @@ class Launch():
                 Defaults to False.
             filename (str, optional): Name of the amp-atomistics generated 
                 input file. Defaults to 'amp_launch.py'.
+            subset (str, optional): If traj_name is a split manifest
+                ([trajectory]_split.json, see amppcmt.split.amp_manifest),
+                name of the set used for the training. Its frames are read
+                from the source trajectory, without copy.
+                Defaults to 'train'.
         """
         self.traj_name = traj_name
         self.amp_param = amp_param
@@ -59,6 +68,8 @@ class Launch():
         self.initial_calc = initial_calc
         self.test = test
         self.filename = filename
+        self.subset = subset
+        self.manifest = traj_name.endswith('.json')
         # Assigning default convergence parameters value
         default_convergence_parameters = {
             'energy_rmse':0.001,
@@ -72,6 +83,31 @@ class Launch():
             for key, value in convergence_parameters.items():
                 self.convergence_parameters[key] = value
         
+    def traj_get_info(self):
+        """
+        Print the number of frames and the species of the training set, and
+        warn if the forces are trained while some frames have none. The
+        metadata are taken from the sidecar index of the trajectory (see
+        amppcmt.split.amp_index) if it is up to date, or gathered in one pass
+        over the trajectory otherwise, without writing any index.
+        """
+        if self.manifest:
+            manifest = read_manifest(self.traj_name, check=False)
+            indexes = [TrajectoryIndex.get(source['filename'], save=False)
+                       for source in manifest['sources']]
+            frames = np.load(manifest['sets'][self.subset])
+        else:
+            indexes = [TrajectoryIndex.get(self.traj_name, save=False)]
+            frames = np.arange(indexes[0].nb_frames)
+        has_forces = np.concatenate([index.has_forces for index in indexes])
+        species = sorted({symbol for index in indexes
+                          for symbol in index.species})
+        print('The training set is composed by {} frames'.format(len(frames)))
+        print('Species: {}'.format(', '.join(species)))
+        if self.forces and not np.all(has_forces[frames]):
+            print('Warning: {} frames of the training set have no forces'.format(
+                np.sum(~has_forces[frames])))
+
     def generate_input(self):
         if self.test:
             template_path = pkg_resources.resource_filename(__name__, 'template_script_test.jinja2')
@@ -85,7 +121,9 @@ class Launch():
                 hiddenlayers = self.hiddenlayers,
                 checkpoints = self.checkpoints,
                 convergence_parameters = self.convergence_parameters,
-                test = self.test
+                test = self.test,
+                manifest = self.manifest,
+                subset = self.subset
         )
         with open(self.filename, 'w') as file:
             file.write(rendered_script)
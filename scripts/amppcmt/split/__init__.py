@@ -1 +1,4 @@
 from .amp_split import Train_test_split
+from .amp_manifest import TrajectoryView
+from .amp_index import TrajectoryIndex
+from .amp_columns import ColumnarTrajectory, convert_trajectory, cached_trajectory
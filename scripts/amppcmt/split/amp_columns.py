@@ -0,0 +1,314 @@
+"""
+Module allowing to convert a trajectory into a columnar dataset, a directory
+of .npy files that can be memory mapped and sliced without decoding any
+frame:
+    - positions.npy: positions of all the atoms, float64 array of shape
+        (n_atoms_total, 3)
+    - numbers.npy: atomic number of each atom, uint8 array of shape
+        (n_atoms_total,)
+    - forces.npy: forces of all the atoms, float64 array of shape
+        (n_atoms_total, 3), NaN for the frames without forces
+    - offsets.npy: index of the first atom of each frame in the atom arrays,
+        int64 array of shape (n_frames + 1,)
+    - cells.npy: cell of each frame, float64 array of shape (n_frames, 3, 3)
+    - pbc.npy: periodic boundary conditions of each frame, bool array of
+        shape (n_frames, 3)
+    - energies.npy: energy of each frame, float64 array of shape
+        (n_frames,), NaN for the frames without energy
+    - constraints.npy: constraints of each frame, index in the list of
+        constraints of columns.json, int64 array of shape (n_frames,), -1 for
+        the frames without constraints
+    - columns.json: number of frames, source trajectory with its size and
+        modification time, distinct constraints of the frames (encoded as in
+        a .traj file)
+The atom arrays follow the layout of the result store of Calc (see
+amppcmt.extract.amp_store). The forces are stored as computed, the
+constraints being applied again by atoms.get_forces() as for a .traj file.
+The other per-atom arrays (tags, momenta, charges, ...) and the info of the
+frames are not stored. A columnar dataset can be given to Train_test_split
+and Calc instead of a trajectory file.
+"""
+
+# IMPORTATIONS
+
+import os
+import json
+from itertools import islice
+import numpy as np
+from ase import Atoms
+from ase.io import iread
+from ase.calculators.singlepoint import SinglePointCalculator
+from ase.constraints import dict2constraint
+from ase.io.jsonio import encode, decode
+from ..extract.amp_store import NpyAppender, RaggedArray
+
+# CONSTANTS
+
+# Name of the description file of a columnar dataset
+COLUMNS_FILENAME = "columns.json"
+
+# Suffix of the default directory of the columnar dataset of a trajectory
+COLUMNS_SUFFIX = ".columns"
+
+# Version of the columnar format
+COLUMNS_VERSION = 2
+
+# Number of frames read and appended at once by the conversion
+CHUNK_SIZE = 1000
+
+# FUNCTIONS
+
+
+def is_columnar(path):
+    """
+    Check whether a path is a columnar dataset
+    """
+    return os.path.isfile(os.path.join(path, COLUMNS_FILENAME))
+
+
+def columns_dirname(filename):
+    """
+    Default directory of the columnar dataset of a trajectory file
+    """
+    return filename + COLUMNS_SUFFIX
+
+
+def convert_trajectory(filename, dirname: str = None, chunk_size: int = CHUNK_SIZE):
+    """
+    Convert a trajectory into a columnar dataset, in one pass. The frames are
+    read and appended to the arrays by chunks, so that the memory used does
+    not depend on the length of the trajectory.
+    Args:
+        filename (str): Name of the trajectory file
+        dirname (str, optional): Directory of the columnar dataset. Defaults to
+            None ([trajectory].columns next to the trajectory).
+        chunk_size (int, optional): Number of frames appended at once.
+            Defaults to CHUNK_SIZE.
+    Returns:
+        ColumnarTrajectory: The columnar dataset
+    """
+    if dirname is None:
+        dirname = columns_dirname(filename)
+    os.makedirs(dirname, exist_ok=True)
+    # The description file is written last, an interrupted conversion leaving
+    # an invalid dataset
+    if os.path.exists(os.path.join(dirname, COLUMNS_FILENAME)):
+        os.remove(os.path.join(dirname, COLUMNS_FILENAME))
+    stat = os.stat(filename)
+
+    def appender(name, dtype, row_shape=()):
+        return NpyAppender(os.path.join(dirname, name + ".npy"), dtype, row_shape)
+
+    appenders = {
+        "positions": appender("positions", np.float64, (3,)),
+        "numbers": appender("numbers", np.uint8),
+        "forces": appender("forces", np.float64, (3,)),
+        "offsets": appender("offsets", np.int64),
+        "cells": appender("cells", np.float64, (3, 3)),
+        "pbc": appender("pbc", bool, (3,)),
+        "energies": appender("energies", np.float64),
+        "constraints": appender("constraints", np.int64),
+    }
+    nb_frames = nb_atoms = 0
+    # Index of each distinct encoded list of constraints
+    constraints = {}
+    appenders["offsets"].write([0])
+    frames = iread(filename, index=":")
+    try:
+        while True:
+            chunk = list(islice(frames, chunk_size))
+            if not chunk:
+                break
+            results = [
+                atoms.calc.results if atoms.calc is not None else {}
+                for atoms in chunk
+            ]
+            positions = RaggedArray.from_frames(
+                [atoms.get_positions() for atoms in chunk], np.float64, (3,)
+            )
+            appenders["positions"].write(positions.data)
+            appenders["numbers"].write(
+                np.concatenate([atoms.get_atomic_numbers() for atoms in chunk])
+            )
+            appenders["forces"].write(
+                np.concatenate(
+                    [
+                        result.get("forces", np.full((len(atoms), 3), np.nan))
+                        for atoms, result in zip(chunk, results)
+                    ]
+                )
+            )
+            appenders["offsets"].write(positions.offsets[1:] + nb_atoms)
+            appenders["cells"].write([np.array(atoms.get_cell()) for atoms in chunk])
+            appenders["pbc"].write([atoms.get_pbc() for atoms in chunk])
+            appenders["energies"].write(
+                [result.get("energy", np.nan) for result in results]
+            )
+            constraint_ids = []
+            for atoms in chunk:
+                if not atoms.constraints:
+                    constraint_ids.append(-1)
+                    continue
+                encoded = encode(
+                    [constraint.todict() for constraint in atoms.constraints]
+                )
+                constraint_ids.append(constraints.setdefault(encoded, len(constraints)))
+            appenders["constraints"].write(constraint_ids)
+            nb_frames += len(chunk)
+            nb_atoms += len(positions.data)
+    finally:
+        for array_appender in appenders.values():
+            array_appender.close()
+
+    columns = {
+        "version": COLUMNS_VERSION,
+        "nb_frames": nb_frames,
+        "nb_atoms": nb_atoms,
+        "source": os.path.abspath(filename),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "constraints": list(constraints),
+    }
+    with open(os.path.join(dirname, COLUMNS_FILENAME), "w") as file:
+        json.dump(columns, file, indent=4)
+    return ColumnarTrajectory(dirname)
+
+
+def cached_trajectory(filename, dirname: str = None):
+    """
+    Columnar dataset of a trajectory, converted if it is missing or if the
+    trajectory changed since the conversion (size or modification time)
+    Args:
+        filename (str): Name of the trajectory file
+        dirname (str, optional): Directory of the columnar dataset. Defaults to
+            None ([trajectory].columns next to the trajectory).
+    Returns:
+        ColumnarTrajectory: The columnar dataset
+    """
+    if dirname is None:
+        dirname = columns_dirname(filename)
+    if is_columnar(dirname):
+        with open(os.path.join(dirname, COLUMNS_FILENAME)) as file:
+            columns = json.load(file)
+        stat = os.stat(filename)
+        if (
+            columns.get("version") == COLUMNS_VERSION
+            and columns["size"] == stat.st_size
+            and columns["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return ColumnarTrajectory(dirname)
+    print("converting {} into the columnar dataset {}".format(filename, dirname))
+    return convert_trajectory(filename, dirname)
+
+
+# CLASSES
+
+
+class ColumnarTrajectory:
+    def __init__(self, dirname: str, mmap_mode: str = "r"):
+        """
+        Read a columnar dataset. The arrays are memory mapped, nothing is read
+        before being accessed. The frames can be sliced as arrays, or taken as
+        ase.Atoms objects (with their constraints and a single point
+        calculator holding the energy and the forces) by indexing or
+        iterating.
+        Args:
+            dirname (str): Directory of the columnar dataset
+            mmap_mode (str, optional): Memory map mode given to np.load.
+                Defaults to 'r'.
+        """
+        self.dirname = dirname
+        with open(os.path.join(dirname, COLUMNS_FILENAME)) as file:
+            self.columns = json.load(file)
+        if self.columns.get("version") != COLUMNS_VERSION:
+            raise ValueError(
+                "The columnar dataset {} has the format version {}, convert the "
+                "trajectory again (version {})".format(
+                    dirname, self.columns.get("version"), COLUMNS_VERSION
+                )
+            )
+
+        def load(name):
+            return np.load(os.path.join(dirname, name + ".npy"), mmap_mode=mmap_mode)
+
+        self.positions = load("positions")
+        self.numbers = load("numbers")
+        self.forces = load("forces")
+        self.offsets = load("offsets")
+        self.cells = load("cells")
+        self.pbc = load("pbc")
+        self.energies = load("energies")
+        self.constraint_ids = load("constraints")
+
+    @property
+    def nb_frames(self):
+        return len(self.energies)
+
+    def __len__(self):
+        return self.nb_frames
+
+    def nb_atoms(self):
+        """
+        Number of atoms of each frame
+        """
+        return np.diff(self.offsets)
+
+    def get_positions(self, start: int = 0, stop: int = None):
+        """
+        Positions of the frames start to stop, as a RaggedArray of views on
+        the positions array
+        """
+        return RaggedArray(self.positions, self.offsets)[start:stop]
+
+    def get_forces(self, start: int = 0, stop: int = None):
+        """
+        Forces of the frames start to stop, as a RaggedArray of views on the
+        forces array
+        """
+        return RaggedArray(self.forces, self.offsets)[start:stop]
+
+    def get_atoms(self, index):
+        """
+        Frame as an ase.Atoms object
+        Args:
+            index (int): Index of the frame
+        Returns:
+            ase.Atoms: The frame, with its constraints and with the energy and
+                the forces in a single point calculator
+        """
+        index = int(index)
+        if index < 0:
+            index += self.nb_frames
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        atoms = Atoms(
+            numbers=self.numbers[start:stop],
+            positions=self.positions[start:stop],
+            cell=self.cells[index],
+            pbc=self.pbc[index],
+        )
+        constraint_id = self.constraint_ids[index]
+        if constraint_id >= 0:
+            atoms.set_constraint(
+                [
+                    dict2constraint(constraint)
+                    for constraint in decode(self.columns["constraints"][constraint_id])
+                ]
+            )
+        results = {}
+        if not np.isnan(self.energies[index]):
+            results["energy"] = float(self.energies[index])
+        forces = np.array(self.forces[start:stop])
+        if not np.isnan(forces).any():
+            results["forces"] = forces
+        if results:
+            atoms.calc = SinglePointCalculator(atoms, **results)
+        return atoms
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_atoms(id) for id in range(*index.indices(len(self)))]
+        return self.get_atoms(index)
+
+    def __iter__(self):
+        for index in range(self.nb_frames):
+            yield self.get_atoms(index)
@@ -0,0 +1,87 @@
+"""
+Module allowing to detect the near-duplicate frames of a trajectory, e.g. the
+long stretches of almost identical configurations of a molecular dynamics.
+The frames are checked one by one, in a single pass. A frame is a duplicate
+if it has the same atoms and cell as a frame kept before and:
+    - no atom moved by more than the tolerance since the last kept frame, or
+    - its positions, quantized on a grid of the tolerance, are the same as
+        the ones of a kept frame (hash of the quantized positions per
+        species), which catches the configurations visited again later
+Only the hashes and the last kept frame are kept in memory.
+"""
+
+# IMPORTATIONS
+
+import hashlib
+import numpy as np
+
+# CLASSES
+
+
+class DuplicateFilter:
+    def __init__(self, tolerance: float = 0.01):
+        """
+        Detect the near-duplicate frames of a trajectory, read in order
+        Args:
+            tolerance (float, optional): Largest displacement of an atom, in
+                Angstrom, between two frames considered identical.
+                Defaults to 0.01.
+        """
+        if not tolerance > 0:
+            raise ValueError(
+                "The tolerance must be strictly positive, not {}".format(tolerance)
+            )
+        self.tolerance = tolerance
+        self.hashes = set()
+        self.last_numbers = None
+        self.last_cell = None
+        self.last_positions = None
+        self.nb_frames = 0
+        self.nb_duplicates = 0
+
+    def frame_hash(self, numbers, positions, cell):
+        """
+        Hash of the positions of the atoms, quantized on a grid of the
+        tolerance and sorted by species, with the cell
+        """
+        order = np.argsort(numbers, kind="stable")
+        quantized = np.floor(positions[order] / self.tolerance).astype(np.int64)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(numbers[order].astype(np.int64).tobytes())
+        digest.update(quantized.tobytes())
+        digest.update(np.round(cell / self.tolerance).astype(np.int64).tobytes())
+        return digest.digest()
+
+    def is_duplicate(self, atoms):
+        """
+        Check whether a frame is a near-duplicate of a frame kept before. The
+        frame is kept otherwise.
+        Args:
+            atoms (ase.Atoms): The frame
+        Returns:
+            bool: True if the frame is a near-duplicate
+        """
+        numbers = atoms.get_atomic_numbers()
+        positions = atoms.get_positions()
+        cell = np.array(atoms.get_cell())
+        self.nb_frames += 1
+
+        duplicate = (
+            self.last_positions is not None
+            and np.array_equal(numbers, self.last_numbers)
+            and np.allclose(cell, self.last_cell, rtol=0.0, atol=self.tolerance)
+            and (
+                not len(positions)
+                or np.abs(positions - self.last_positions).max() <= self.tolerance
+            )
+        )
+        key = self.frame_hash(numbers, positions, cell)
+        if duplicate or key in self.hashes:
+            self.nb_duplicates += 1
+            return True
+
+        self.hashes.add(key)
+        self.last_numbers = numbers
+        self.last_cell = cell
+        self.last_positions = positions
+        return False
@@ -0,0 +1,96 @@
+"""
+Module allowing to select the most diverse frames of a trajectory by
+farthest-point sampling. Each frame is described by a cheap descriptor:
+    - the histogram of its interatomic distances (periodic images included),
+        normalized by the number of atoms, which does not depend on the order
+        nor on the rotation of the atoms
+    - optionally, its potential energy per atom, weighted
+The frames are then selected one by one, each new frame being the farthest
+one (euclidean distance between the descriptors) from the frames already
+selected. The distances to the selected frames are updated by chunks of
+frames, with one matrix-vector product per chunk.
+"""
+
+# IMPORTATIONS
+
+import numpy as np
+from ase.neighborlist import neighbor_list
+
+# CONSTANTS
+
+# Number of frames whose distances are updated at once
+CHUNK_SIZE = 65536
+
+# Number of frames selected times number of frames above which the sampling
+# takes about a minute (one pass over the descriptors per frame selected)
+SLOW_SAMPLING = 10**9
+
+# FUNCTIONS
+
+
+def frame_descriptor(
+    atoms, nb_bins: int = 32, r_max: float = 6.0, energy_weight: float = 0.0
+):
+    """
+    Descriptor of a frame: histogram of the interatomic distances up to
+    r_max, normalized by the number of atoms, followed by the weighted
+    potential energy per atom if energy_weight is not zero
+    Args:
+        atoms (ase.Atoms): The frame
+        nb_bins (int, optional): Number of bins of the histogram.
+            Defaults to 32.
+        r_max (float, optional): Largest distance of the histogram, in
+            Angstrom. Defaults to 6.0.
+        energy_weight (float, optional): Weight of the energy per atom (in eV)
+            with respect to the histogram. Defaults to 0.0 (not used).
+    Returns:
+        np.ndarray: Descriptor of the frame
+    """
+    distances = neighbor_list("d", atoms, r_max)
+    histogram, _ = np.histogram(distances, bins=nb_bins, range=(0.0, r_max))
+    descriptor = histogram / max(len(atoms), 1)
+    if energy_weight:
+        energy = atoms.get_potential_energy() / max(len(atoms), 1)
+        descriptor = np.append(descriptor, energy_weight * energy)
+    return descriptor
+
+
+def farthest_point_sampling(descriptors, nb_selected: int, first: int = None):
+    """
+    Select the frames farthest from each other
+    Args:
+        descriptors (np.ndarray): Descriptors of the frames, shape
+            (nb_frames, descriptor size)
+        nb_selected (int): Number of frames to select
+        first (int, optional): Index of the first frame selected. Defaults to
+            None (the frame farthest from the mean descriptor).
+    Returns:
+        np.ndarray: Indexes of the selected frames, in the order of selection
+    """
+    descriptors = np.asarray(descriptors, dtype=np.float64)
+    nb_frames = len(descriptors)
+    nb_selected = min(nb_selected, nb_frames)
+    if nb_selected <= 0:
+        return np.empty(0, dtype=np.int64)
+    # Squared norms, the squared distance to a frame c being
+    # |x|^2 + |c|^2 - 2 x.c
+    norms = np.einsum("ij,ij->i", descriptors, descriptors)
+    if first is None:
+        centered = descriptors - descriptors.mean(axis=0)
+        first = int(np.argmax(np.einsum("ij,ij->i", centered, centered)))
+
+    selected = np.empty(nb_selected, dtype=np.int64)
+    selected[0] = first
+    min_distances = np.full(nb_frames, np.inf)
+    for rank in range(1, nb_selected):
+        last = selected[rank - 1]
+        for start in range(0, nb_frames, CHUNK_SIZE):
+            stop = start + CHUNK_SIZE
+            distances = norms[start:stop] + norms[last]
+            distances -= 2.0 * descriptors[start:stop] @ descriptors[last]
+            chunk = min_distances[start:stop]
+            np.minimum(chunk, distances, out=chunk)
+        # The selected frames are never selected again
+        min_distances[last] = -np.inf
+        selected[rank] = np.argmax(min_distances)
+    return selected
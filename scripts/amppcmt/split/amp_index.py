@@ -0,0 +1,240 @@
+"""
+Module allowing to index a trajectory file once, in a sidecar file
+[trajectory].index.npz written next to it. The index holds, for each frame:
+    - its byte offset in the file (.traj, .xyz and .extxyz files), to seek
+        straight to the frame
+    - its number of atoms
+    - the presence of an energy and of forces
+with the species of the trajectory and the atomic numbers of the first frame.
+The index is invalidated when the size or the modification time of the
+trajectory file change, and then built again. For .traj files, the index is
+built from the headers of the frames, without decoding their arrays.
+"""
+
+# IMPORTATIONS
+
+import io
+import os
+import tempfile
+import numpy as np
+from ase.io import read, iread
+from ase.io.formats import filetype
+from ase.io.ulm import Reader
+from ase.data import chemical_symbols
+
+# CONSTANTS
+
+INDEX_SUFFIX = ".index.npz"
+
+# Version of the index format, an index of another version is built again
+INDEX_VERSION = 1
+
+# FUNCTIONS
+
+
+def index_filename(filename):
+    """
+    Name of the sidecar index of a trajectory file
+    """
+    return filename + INDEX_SUFFIX
+
+
+def xyz_offsets(filename):
+    """
+    Byte offsets of the frames of a .xyz or .extxyz file, found by reading the
+    number of atoms of each frame and skipping its lines
+    Returns:
+        np.ndarray: Offset of each frame
+    """
+    offsets = []
+    with open(filename, "rb") as file:
+        while True:
+            offset = file.tell()
+            line = file.readline()
+            if not line.strip():
+                break
+            offsets.append(offset)
+            for _ in range(int(line) + 1):
+                file.readline()
+    return np.array(offsets, dtype=np.int64)
+
+
+# CLASSES
+
+
+class TrajectoryIndex:
+    def __init__(self, filename, arrays):
+        """
+        Index of a trajectory file. Use TrajectoryIndex.get to load the
+        sidecar index, or build it if missing or out of date.
+        Args:
+            filename (str): Name of the trajectory file
+            arrays (dict): Content of the index (see build)
+        """
+        self.filename = filename
+        self.size = int(arrays["size"])
+        self.mtime_ns = int(arrays["mtime_ns"])
+        self.offsets = np.asarray(arrays["offsets"], dtype=np.int64)
+        self.nb_atoms = np.asarray(arrays["nb_atoms"], dtype=np.int64)
+        self.has_energy = np.asarray(arrays["has_energy"], dtype=bool)
+        self.has_forces = np.asarray(arrays["has_forces"], dtype=bool)
+        self.species = [str(symbol) for symbol in arrays["species"]]
+        self.first_numbers = np.asarray(arrays["first_numbers"], dtype=np.int64)
+
+    @property
+    def nb_frames(self):
+        return len(self.nb_atoms)
+
+    @property
+    def first_symbols(self):
+        """
+        Chemical symbols of the atoms of the first frame
+        """
+        return [chemical_symbols[number] for number in self.first_numbers]
+
+    @classmethod
+    def get(cls, filename, save: bool = True):
+        """
+        Load the index of a trajectory, building it if it is missing or out
+        of date
+        Args:
+            filename (str): Name of the trajectory file
+            save (bool, optional): Write the index built in the sidecar file.
+                Defaults to True.
+        Returns:
+            TrajectoryIndex: The index
+        """
+        index = cls.load(filename)
+        if index is None:
+            index = cls.build(filename)
+            if save:
+                index.save()
+        return index
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load the sidecar index of a trajectory
+        Returns:
+            TrajectoryIndex: The index, or None if it is missing or out of date
+        """
+        try:
+            with np.load(index_filename(filename)) as arrays:
+                if int(arrays["version"]) != INDEX_VERSION:
+                    return None
+                index = cls(filename, arrays)
+        except (OSError, KeyError, ValueError):
+            return None
+        return index if index.is_valid() else None
+
+    @classmethod
+    def build(cls, filename):
+        """
+        Index a trajectory file, in one pass
+        """
+        stat = os.stat(filename)
+        arrays = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        nb_atoms, has_energy, has_forces, numbers = [], [], [], set()
+        first_numbers = np.empty(0, dtype=np.int64)
+        format = filetype(filename)
+        if format == "traj":
+            # Headers of the frames, the atomic numbers being only stored
+            # when they change
+            reader = Reader(filename)
+            try:
+                # Private attribute of the ULM reader, the offsets are left
+                # unknown (sequential access) if it changes
+                offsets = getattr(reader, "_offsets", None)
+                if offsets is None or len(offsets) != len(reader):
+                    offsets = np.full(len(reader), -1)
+                arrays["offsets"] = np.array(offsets, dtype=np.int64)
+                for id in range(len(reader)):
+                    item = reader[id]
+                    if "numbers" in item:
+                        frame_numbers = np.asarray(item.numbers)
+                        numbers.update(frame_numbers.tolist())
+                        if id == 0:
+                            first_numbers = frame_numbers
+                    nb_atoms.append(item.positions.shape[0])
+                    calculator = item.get("calculator")
+                    keys = calculator.keys() if calculator is not None else ()
+                    has_energy.append("energy" in keys)
+                    has_forces.append("forces" in keys)
+            finally:
+                reader.close()
+        else:
+            for id, atoms in enumerate(iread(filename, index=":")):
+                frame_numbers = atoms.get_atomic_numbers()
+                numbers.update(frame_numbers.tolist())
+                if id == 0:
+                    first_numbers = frame_numbers
+                nb_atoms.append(len(atoms))
+                results = atoms.calc.results if atoms.calc is not None else {}
+                has_energy.append("energy" in results)
+                has_forces.append("forces" in results)
+            if format in ("xyz", "extxyz"):
+                arrays["offsets"] = xyz_offsets(filename)
+            else:
+                arrays["offsets"] = np.full(len(nb_atoms), -1, dtype=np.int64)
+        arrays.update(
+            nb_atoms=nb_atoms,
+            has_energy=has_energy,
+            has_forces=has_forces,
+            species=[chemical_symbols[number] for number in sorted(numbers)],
+            first_numbers=first_numbers,
+        )
+        return cls(filename, arrays)
+
+    def save(self):
+        """
+        Write the index in the sidecar file. The index is not written if the
+        directory is read-only.
+        """
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=directory, suffix=INDEX_SUFFIX, delete=False
+            ) as file:
+                temporary_filename = file.name
+                np.savez(
+                    file,
+                    version=INDEX_VERSION,
+                    size=self.size,
+                    mtime_ns=self.mtime_ns,
+                    offsets=self.offsets,
+                    nb_atoms=self.nb_atoms,
+                    has_energy=self.has_energy,
+                    has_forces=self.has_forces,
+                    species=np.array(self.species, dtype=str),
+                    first_numbers=self.first_numbers,
+                )
+            os.replace(temporary_filename, index_filename(self.filename))
+        except OSError:
+            pass
+
+    def is_valid(self):
+        """
+        Check that the trajectory file did not change since it was indexed
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def read_frame(self, id):
+        """
+        Read one frame, seeking straight to it when its offset is known
+        Args:
+            id (int): Index of the frame
+        Returns:
+            ase.Atoms: The frame
+        """
+        format = filetype(self.filename)
+        if format == "traj" or self.offsets[id] < 0:
+            return read(self.filename, index=int(id))
+        # Lines of the frame: number of atoms, comment and atoms
+        with open(self.filename) as file:
+            file.seek(self.offsets[id])
+            lines = [file.readline() for _ in range(self.nb_atoms[id] + 2)]
+        return read(io.StringIO("".join(lines)), index=0, format=format)
@@ -0,0 +1,363 @@
+"""
+Module allowing to save a split as an index manifest instead of copying the
+frames. A manifest is made of:
+    - one .npy file per set, e.g. [trajectory]_train.npy and
+        [trajectory]_test.npy, holding the indexes of the frames of the set
+    - a JSON file, [trajectory]_split.json, giving the source trajectories
+        with their number of frames, size, modification time and SHA-256
+        hash, the .npy file of each set and the parameters of the split
+        (method, seed, ...)
+The frames of several source trajectories are numbered one after the other.
+The frames of a set are then served from the source trajectories by a
+TrajectoryView, which reads them lazily, one by one.
+"""
+
+# IMPORTATIONS
+
+import os
+import json
+import hashlib
+import numpy as np
+from ase.io import read, iread, Trajectory
+from ase.io.formats import filetype
+from .amp_index import TrajectoryIndex
+from .amp_columns import ColumnarTrajectory, is_columnar
+
+# CONSTANTS
+
+# Number of bytes read at once to hash a file
+HASH_CHUNK_SIZE = 1 << 20
+
+# FUNCTIONS
+
+
+def dataset_files(path):
+    """
+    Files of a trajectory: the file itself, or the sorted files of a columnar
+    dataset (see amp_columns)
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if os.path.isfile(os.path.join(path, name))
+    )
+
+
+def file_hash(filename):
+    """
+    SHA-256 hash of the content of a file (or of the files of a columnar
+    dataset), read by chunks
+    Args:
+        filename (str): Name of the file
+    Returns:
+        str: Hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    for path in dataset_files(filename):
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_size(filename):
+    """
+    Size of a file (or of the files of a columnar dataset), in bytes
+    """
+    return sum(os.path.getsize(path) for path in dataset_files(filename))
+
+
+def file_mtime(filename):
+    """
+    Modification time of a file (or latest one of the files of a columnar
+    dataset), in nanoseconds
+    """
+    return max(os.stat(path).st_mtime_ns for path in dataset_files(filename))
+
+
+def source_changed(source, full_hash: bool = False):
+    """
+    Check whether a source trajectory of a manifest changed since the split.
+    The size, the modification time and the number of frames are compared,
+    which does not read the frames. The content is hashed only if the
+    modification time changed (e.g. a copy of the trajectory) or if
+    full_hash is set.
+    Args:
+        source (dict): Source trajectory of the manifest, see write_manifest
+        full_hash (bool, optional): Always compare the SHA-256 hash of the
+            content. Defaults to False.
+    Returns:
+        bool: True if the trajectory changed
+    """
+    filename = source["filename"]
+    if file_size(filename) != source["size"]:
+        return True
+    if not full_hash:
+        if count_frames(filename) != source["nb_frames"]:
+            return True
+        if source.get("mtime_ns") == file_mtime(filename):
+            return False
+    return file_hash(filename) != source["sha256"]
+
+
+def count_frames(filename):
+    """
+    Count the frames of a trajectory without keeping them in memory. The
+    number of frames of a columnar dataset (see amp_columns) is read from its
+    arrays, and the one of a trajectory file from the sidecar index (see
+    amp_index) if it is up to date. Otherwise, the length of a .traj file is
+    read from its header without decoding any frame, and the other formats
+    are indexed.
+    Args:
+        filename (str): Name of the trajectory file
+    Returns:
+        int: Number of frames
+    """
+    if is_columnar(filename):
+        return ColumnarTrajectory(filename).nb_frames
+    index = TrajectoryIndex.load(filename)
+    if index is not None:
+        return index.nb_frames
+    if filetype(filename) == "traj":
+        with Trajectory(filename) as trajectory:
+            return len(trajectory)
+    return TrajectoryIndex.get(filename).nb_frames
+
+
+def iread_frames(filename, start: int = 0):
+    """
+    Iterate over the frames of a trajectory file or of a columnar dataset
+    (see amp_columns), one by one
+    Args:
+        filename (str): Name of the trajectory file, or directory of the
+            columnar dataset
+        start (int, optional): Index of the first frame. Defaults to 0.
+    """
+    if is_columnar(filename):
+        dataset = ColumnarTrajectory(filename)
+        for index in range(start, dataset.nb_frames):
+            yield dataset.get_atoms(index)
+        return
+    yield from iread(filename, index=slice(start, None))
+
+
+def read_frames(filename, indexes):
+    """
+    Iterate over some frames of a trajectory. The frames of a .traj file, or
+    of a file with byte offsets in its sidecar index (see amp_index), are
+    accessed directly. The others are read in one pass, skipping the frames
+    not selected.
+    Args:
+        filename (str): Name of the trajectory file
+        indexes (np.ndarray): Sorted indexes of the frames
+    """
+    if not len(indexes):
+        return
+    if is_columnar(filename):
+        dataset = ColumnarTrajectory(filename)
+        for index in indexes:
+            yield dataset.get_atoms(index)
+        return
+    if filetype(filename) == "traj":
+        with Trajectory(filename) as trajectory:
+            for index in indexes:
+                yield trajectory[int(index)]
+        return
+    trajectory_index = TrajectoryIndex.load(filename)
+    if trajectory_index is not None and np.all(trajectory_index.offsets >= 0):
+        for index in indexes:
+            yield trajectory_index.read_frame(index)
+        return
+    selected = iter(indexes)
+    next_index = next(selected)
+    first_index = next_index
+    for index, atoms in enumerate(iread(filename, index=slice(first_index, None))):
+        if index + first_index == next_index:
+            yield atoms
+            next_index = next(selected, None)
+            if next_index is None:
+                return
+
+
+def write_manifest(manifest_name, sources, sets, nb_frames, sha256=None, **parameters):
+    """
+    Write the index manifest of a split
+    Args:
+        manifest_name (str): Name of the JSON file of the manifest, ending
+            with '_split.json'
+        sources (str or list): Name(s) of the split trajectory file(s)
+        sets (dict): Indexes of the frames of each set, e.g.
+            {'train': [...], 'test': [...]}
+        nb_frames (int or list): Number of frames of each source trajectory
+        sha256 (str or list, optional): Hash of each source trajectory, if
+            already computed (see file_hash). Defaults to None (computed).
+        parameters: Parameters of the split saved in the manifest, e.g. the
+            method and the seed
+    """
+    base = manifest_name[: -len("_split.json")]
+    directory = os.path.dirname(os.path.abspath(manifest_name))
+    set_filenames = {}
+    for name, indexes in sets.items():
+        set_filename = "{}_{}.npy".format(base, name)
+        np.save(set_filename, np.asarray(indexes, dtype=np.int64))
+        set_filenames[name] = os.path.relpath(set_filename, directory)
+    if isinstance(sources, str):
+        sources, nb_frames, sha256 = [sources], [nb_frames], [sha256]
+    if sha256 is None:
+        sha256 = [None] * len(sources)
+    manifest = {
+        "sources": [
+            {
+                "filename": os.path.relpath(source, directory),
+                "nb_frames": int(nb_source_frames),
+                "size": file_size(source),
+                "mtime_ns": file_mtime(source),
+                "sha256": file_hash(source) if source_hash is None else source_hash,
+            }
+            for source, nb_source_frames, source_hash in zip(
+                sources, nb_frames, sha256
+            )
+        ],
+        "sets": set_filenames,
+        "parameters": parameters,
+    }
+    with open(manifest_name, "w") as file:
+        json.dump(manifest, file, indent=4)
+
+
+def read_manifest(manifest_name, check: bool = True):
+    """
+    Read the index manifest of a split
+    Args:
+        manifest_name (str): Name of the JSON file of the manifest
+        check (bool or str, optional): Check that the source trajectories
+            did not change since the split: True compares their size,
+            modification time and number of frames, 'hash' their size and
+            SHA-256 hash, which reads them entirely (see source_changed).
+            Defaults to True.
+    Returns:
+        dict: Content of the manifest, the paths being resolved with respect
+            to the current working directory
+    """
+    with open(manifest_name) as file:
+        manifest = json.load(file)
+    directory = os.path.dirname(os.path.abspath(manifest_name))
+    for source in manifest["sources"]:
+        source["filename"] = os.path.join(directory, source["filename"])
+        if check and source_changed(source, full_hash=check == "hash"):
+            raise ValueError(
+                "The trajectory {} changed since the split {}".format(
+                    source["filename"], manifest_name
+                )
+            )
+    manifest["sets"] = {
+        name: os.path.join(directory, set_filename)
+        for name, set_filename in manifest["sets"].items()
+    }
+    return manifest
+
+
+# CLASSES
+
+
+class TrajectoryView:
+    def __init__(self, filenames, indexes=None, nb_frames=None):
+        """
+        Read-only view on some frames of one or several trajectories, read
+        lazily from the files. It can be iterated, indexed and given as images
+        to amp, or to Calc instead of a trajectory filename (single
+        trajectory only).
+        Args:
+            filenames (str or list): Name(s) of the trajectory file(s), whose
+                frames are numbered one after the other
+            indexes (array_like, optional): Indexes of the frames of the view.
+                Defaults to None (all the frames).
+            nb_frames (list, optional): Number of frames of each trajectory.
+                Defaults to None (counted, see count_frames).
+        """
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        self.filenames = list(filenames)
+        if nb_frames is None:
+            nb_frames = [count_frames(filename) for filename in self.filenames]
+        # Index of the first frame of each trajectory
+        self.offsets = np.concatenate([[0], np.cumsum(nb_frames)]).astype(np.int64)
+        if indexes is None:
+            indexes = range(self.offsets[-1])
+        self.indexes = np.asarray(indexes, dtype=np.int64)
+
+    @property
+    def filename(self):
+        """
+        Name of the trajectory file of a view on a single trajectory
+        """
+        if len(self.filenames) != 1:
+            raise ValueError(
+                "The view spans {} trajectories".format(len(self.filenames))
+            )
+        return self.filenames[0]
+
+    @classmethod
+    def from_manifest(cls, manifest_name: str, subset: str = "train", check=True):
+        """
+        View on one set of a split saved as an index manifest
+        Args:
+            manifest_name (str): Name of the JSON file of the manifest
+            subset (str, optional): Name of the set. Defaults to 'train'.
+            check (bool or str, optional): Check that the source
+                trajectories did not change since the split, 'hash' to
+                compare their hash (see read_manifest). Defaults to True.
+        """
+        manifest = read_manifest(manifest_name, check=check)
+        if subset not in manifest["sets"]:
+            raise KeyError(
+                "No set {} in {}, available sets: {}".format(
+                    subset, manifest_name, ", ".join(manifest["sets"])
+                )
+            )
+        return cls(
+            [source["filename"] for source in manifest["sources"]],
+            np.load(manifest["sets"][subset]),
+            [source["nb_frames"] for source in manifest["sources"]],
+        )
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def locate(self, index):
+        """
+        Trajectory file and index in this file of a frame
+        """
+        file_id = np.searchsorted(self.offsets, index, side="right") - 1
+        return self.filenames[file_id], int(index - self.offsets[file_id])
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            filename, index = self.locate(self.indexes[item])
+            if is_columnar(filename):
+                return ColumnarTrajectory(filename).get_atoms(index)
+            if filetype(filename) == "traj":
+                with Trajectory(filename) as trajectory:
+                    return trajectory[index]
+            trajectory_index = TrajectoryIndex.load(filename)
+            if trajectory_index is not None:
+                return trajectory_index.read_frame(index)
+            return read(filename, index=index)
+        return TrajectoryView(
+            self.filenames, self.indexes[item], np.diff(self.offsets)
+        )
+
+    def __iter__(self):
+        if np.any(np.diff(self.indexes) <= 0):
+            # Unsorted indexes: one read per frame
+            for position in range(len(self.indexes)):
+                yield self[position]
+            return
+        # Sorted indexes: the frames of each file, in order
+        file_ids = np.searchsorted(self.offsets, self.indexes, side="right") - 1
+        for file_id, filename in enumerate(self.filenames):
+            indexes = self.indexes[file_ids == file_id] - self.offsets[file_id]
+            yield from read_frames(filename, indexes)
+
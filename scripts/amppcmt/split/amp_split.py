@@ -1,10 +1,16 @@
 # Importation
-from ase.io import read, Trajectory
+from ase.io import Trajectory
 import random
 from functools import wraps
 import time
 import logging
 import os
+import glob
+from itertools import chain
+import numpy as np
+from .amp_manifest import write_manifest, file_hash, count_frames, iread_frames
+from .amp_diversity import frame_descriptor, farthest_point_sampling, SLOW_SAMPLING
+from .amp_dedup import DuplicateFilter
 
 # Create and configure logger
 print(
@@ -36,28 +42,150 @@ def timeit(func):
     return timeit_wrapper
 
 
+def resolve_trajectories(trajectory):
+    """
+    List the trajectory files of a data set
+    Args:
+        trajectory (str or list): Name of a trajectory file, glob pattern (e.g.
+            'runs/*.traj') or list of trajectory files
+    Returns:
+        list: Names of the trajectory files, sorted for a glob pattern
+    """
+    if not isinstance(trajectory, str):
+        return list(trajectory)
+    if glob.has_magic(trajectory):
+        filenames = sorted(glob.glob(trajectory))
+        if not filenames:
+            raise FileNotFoundError("No trajectory file matches {}".format(trajectory))
+        return filenames
+    return [trajectory]
+
+
 class Train_test_split:
     @timeit
-    def __init__(self, trajectory: str, training_set_percentage: float = 0.75):
+    def __init__(
+        self,
+        trajectory,
+        training_set_percentage: float = 0.75,
+        stream: bool = False,
+        manifest: bool = False,
+        seed: int = None,
+        dedup_tolerance: float = None,
+        output_name: str = None,
+    ):
         """
         Initialize the class. The purpose is to split a trajectory file into a train and
         a test trajectory files.
         Args:
-            trajectory (str): Name of the initial trajectroy file
+            trajectory (str or list): Name of the initial trajectroy file. Several
+                trajectory files (e.g. separate molecular dynamics runs) can be given
+                as a list or a glob pattern ('runs/*.traj'): their frames are numbered
+                one after the other, without merging the files.
             training_set_percentage (float, optional): Percentage of the trajectory into
                 the training set trajectory. Defaults to 0.75.
+            stream (bool, optional): Do not load the trajectory in memory. The frames
+                are counted first, then read one by one and written to the train or
+                test file in a single pass. Defaults to False.
+            manifest (bool, optional): Do not write the frames. The indexes of the
+                frames of each set are saved in .npy files, with a JSON manifest giving
+                the source trajectory and its hash (see amp_manifest). The trajectory is
+                not loaded. Defaults to False.
+            seed (int, optional): Seed of the random split. Defaults to None.
+            dedup_tolerance (float, optional): Remove the near-duplicate frames before
+                the split, i.e. the frames whose atoms moved by less than this
+                tolerance (in Angstrom) with respect to a frame kept before (see
+                amp_dedup). The duplicates are detected in one pass over the
+                trajectory and the split acts on the remaining frames. Must be
+                strictly positive. Defaults to None (no deduplication).
+            output_name (str, optional): Prefix of the output files. Defaults to
+                None (name of the trajectory file without extension, or 'dataset'
+                for several trajectory files).
         """
+        if dedup_tolerance is not None and not dedup_tolerance > 0:
+            raise ValueError(
+                "The deduplication tolerance must be strictly positive, not {}".format(
+                    dedup_tolerance
+                )
+            )
         self.trajectory_name = trajectory
-        self.trajectory = read(trajectory, index=":")  # Read the trajectory
+        self.trajectory_names = resolve_trajectories(trajectory)
+        if output_name is None:
+            if len(self.trajectory_names) == 1:
+                output_name = self.trajectory_names[0].split(sep=".")[0]
+            else:
+                output_name = "dataset"
+        self.output_name = output_name
         self.training_set_percentage = training_set_percentage
-        self.total_length = len(self.trajectory)
+        self.stream = stream
+        self.manifest = manifest
+        self.seed = seed
+        if stream or manifest:
+            self.trajectory = None
+            self.file_lengths = [count_frames(name) for name in self.trajectory_names]
+        else:
+            # Read the trajectory
+            self.trajectory = []
+            self.file_lengths = []
+            for name in self.trajectory_names:
+                frames = list(iread_frames(name))
+                self.trajectory.extend(frames)
+                self.file_lengths.append(len(frames))
+        # Index of the first frame of each trajectory file
+        self.file_offsets = np.concatenate([[0], np.cumsum(self.file_lengths)])
+        self.total_length = int(self.file_offsets[-1])
+        if len(self.trajectory_names) > 1:
+            print(
+                "The data set is composed by {} trajectory files".format(
+                    len(self.trajectory_names)
+                )
+            )
+            logger.debug(
+                "Trajectory files: {}".format(", ".join(self.trajectory_names))
+            )
+        # Number of frames of the input trajectories and indexes of the frames used
+        # for the split (None if all the frames are used)
+        self.nb_frames = self.total_length
+        self.frame_ids = None
+        self.dedup_tolerance = dedup_tolerance
+        if dedup_tolerance is not None:
+            self.deduplicate(dedup_tolerance)
+
+    @timeit
+    def deduplicate(self, tolerance: float):
+        """
+        Remove the near-duplicate frames of the input trajectory (see amp_dedup), in
+        one pass. The next splits only act on the remaining frames.
+        Args:
+            tolerance (float): Largest displacement of an atom, in Angstrom, between
+                two frames considered identical
+        """
+        duplicates = DuplicateFilter(tolerance)
+        kept = [
+            id
+            for id, frame in enumerate(self._frames())
+            if not duplicates.is_duplicate(frame)
+        ]
+        if self.trajectory is not None:
+            self.trajectory = [self.trajectory[id] for id in kept]
+        self.frame_ids = self._source_ids(kept)
+        self.total_length = len(self.frame_ids)
+        print(
+            "{} near-duplicate frames removed, {} frames remaining".format(
+                duplicates.nb_duplicates, self.total_length
+            )
+        )
+        logger.debug(
+            "{} near-duplicate frames removed (tolerance {} A), {} frames "
+            "remaining".format(duplicates.nb_duplicates, tolerance, self.total_length)
+        )
 
     def _filename_generation(self):
         """
         Generate the output filenames from the input filename.
         """
-        self.test_traj_name = self.trajectory_name.split(sep=".")[0] + "_test.traj"
-        self.train_traj_name = self.trajectory_name.split(sep=".")[0] + "_train.traj"
+        self.test_traj_name = self.output_name + "_test.traj"
+        self.train_traj_name = self.output_name + "_train.traj"
+        self.manifest_name = self.output_name + "_split.json"
 
     def traj_get_info(self):
         """
@@ -79,6 +207,10 @@ class Train_test_split:
         # Filenames generation
         self._filename_generation()
         # Printing information about outfiles
+        if self.manifest:
+            print("The split is saved as {}".format(self.manifest_name))
+            logger.debug("The split is saved as {}".format(self.manifest_name))
+            return
         print("The test trajectory is saved as {}".format(self.test_traj_name))
         logger.debug("The test trajectory is saved as {}".format(self.test_traj_name))
 
@@ -93,7 +225,21 @@ class Train_test_split:
         self.traj_get_info()
 
         # Randomly selecting configurations for the test set (smaller)
-        id_test_list = random.sample(range(0, self.total_length), self.nb_test)
+        generator = random if self.seed is None else random.Random(self.seed)
+        id_test_list = generator.sample(range(0, self.total_length), self.nb_test)
+        id_test = set(id_test_list)
+
+        if self.manifest:
+            self._write_manifest(
+                [id for id in range(self.total_length) if id not in id_test],
+                sorted(id_test_list),
+                method="random",
+            )
+            return
+
+        if self.stream:
+            self._stream_split(id_test)
+            return
 
         # Creating test_list_trajectory file
         self.test_traj = Trajectory(filename=self.test_traj_name, mode="w")
@@ -105,7 +251,7 @@ class Train_test_split:
         self.train_traj = Trajectory(filename=self.train_traj_name, mode="w")
         for id in range(self.total_length):
             # Passing if id is in the test set
-            if id in id_test_list:
+            if id in id_test:
                 continue
             frame = self.trajectory[id]
             self.train_traj.write(frame)
@@ -121,6 +267,18 @@ class Train_test_split:
         # Generating filenames
         self.traj_get_info()
 
+        if self.manifest:
+            self._write_manifest(
+                range(self.nb_training),
+                range(self.nb_training, self.total_length),
+                method="time",
+            )
+            return
+
+        if self.stream:
+            self._stream_split(range(self.nb_training, self.total_length))
+            return
+
         # Creating train_list_trajectory file
         self.train_traj = Trajectory(filename=self.train_traj_name, mode="w")
         for id in range(self.nb_training):
@@ -134,6 +292,434 @@ class Train_test_split:
             frame = self.trajectory[id]
             self.test_traj.write(frame)
 
+    @timeit
+    def split_sets_blocked(self, block_length: int, gap: int = 0):
+        """
+        Split the input trajectory into interleaved blocks of consecutive frames:
+        a training block, a gap, a test block, a gap, a training block, ... The
+        frames of the gaps are discarded, so that the frames at the boundaries of
+        the training and test blocks, highly correlated in a molecular dynamics, do
+        not leak between the sets. The length of the training blocks follows from
+        training_set_percentage. Both trajectories are written in a single pass and
+        the blocks are written in the logfile.
+        Args:
+            block_length (int): Number of frames of each test block
+            gap (int, optional): Number of frames discarded at each boundary
+                between a training and a test block. Defaults to 0.
+        """
+        if not 0.0 < self.training_set_percentage < 1.0:
+            raise ValueError(
+                "The blocked split needs a training_set_percentage strictly between "
+                "0 and 1, not {}".format(self.training_set_percentage)
+            )
+        if block_length < 1:
+            raise ValueError(
+                "The length of the test blocks must be at least 1, not {}".format(
+                    block_length
+                )
+            )
+        if gap < 0:
+            raise ValueError("The gap must be positive or zero, not {}".format(gap))
+        train_length = max(
+            1,
+            round(
+                block_length
+                * self.training_set_percentage
+                / (1.0 - self.training_set_percentage)
+            ),
+        )
+        period = train_length + block_length + 2 * gap
+        # Position of each frame in its period: training block, gap, test block, gap
+        phases = np.arange(self.total_length) % period
+        in_train = phases < train_length
+        in_test = (phases >= train_length + gap) & (
+            phases < train_length + gap + block_length
+        )
+
+        # Number of frames of each set
+        self.nb_training = int(in_train.sum())
+        self.nb_test = int(in_test.sum())
+        print("The trajectory is composed by {} frames".format(self.total_length))
+        print(
+            "The number of frames in the training set is: {}".format(self.nb_training)
+        )
+        print("The number of frames in the test set is: {}".format(self.nb_test))
+        print(
+            "The number of discarded frames is: {}".format(
+                self.total_length - self.nb_training - self.nb_test
+            )
+        )
+        self._filename_generation()
+
+        # Layout of the blocks
+        logger.debug(
+            "Blocked split: training blocks of {} frames, test blocks of {} frames, "
+            "gaps of {} frames".format(train_length, block_length, gap)
+        )
+        labels = np.where(in_train, 0, np.where(in_test, 1, 2))
+        boundaries = np.flatnonzero(np.diff(labels)) + 1
+        starts = np.concatenate([[0], boundaries])
+        stops = np.concatenate([boundaries, [self.total_length]])
+        for start, stop in zip(starts, stops):
+            logger.debug(
+                "Frames {} to {}: {}".format(
+                    start, stop - 1, ("training", "test", "gap")[labels[start]]
+                )
+            )
+
+        if self.manifest:
+            print("The split is saved as {}".format(self.manifest_name))
+            self._write_manifest(
+                np.flatnonzero(in_train),
+                np.flatnonzero(in_test),
+                method="blocked",
+                block_length=block_length,
+                gap=gap,
+            )
+            return
+
+        print("The test trajectory is saved as {}".format(self.test_traj_name))
+        self._stream_split(
+            set(np.flatnonzero(in_test).tolist()),
+            set(np.flatnonzero(in_train).tolist()),
+        )
+
+    @timeit
+    def split_sets_file(self):
+        """
+        Split a data set made of several trajectory files, each file being kept whole
+        in the training or the test set, so that the frames of a molecular dynamics
+        run do not leak between the two sets. The files are shuffled (see seed) and
+        added to the training set until it holds about training_set_percentage of the
+        frames, the other files making the test set.
+        """
+        if len(self.trajectory_names) < 2:
+            raise ValueError("The split by file needs several trajectory files")
+        self.traj_get_info()
+
+        # File of each frame used for the split
+        file_ids = (
+            np.searchsorted(
+                self.file_offsets, self._source_ids(range(self.total_length)), "right"
+            )
+            - 1
+        )
+        file_sizes = np.bincount(file_ids, minlength=len(self.trajectory_names))
+        generator = random if self.seed is None else random.Random(self.seed)
+        order = generator.sample(range(len(self.trajectory_names)), len(file_sizes))
+        # Number of training frames with the first files of the shuffled order,
+        # keeping the number closest to nb_training
+        cumulated = np.concatenate([[0], np.cumsum(file_sizes[order])])
+        nb_train_files = int(np.argmin(np.abs(cumulated - self.nb_training)))
+        nb_train_files = min(max(nb_train_files, 1), len(order) - 1)
+        train_files = sorted(order[:nb_train_files])
+        in_train = np.isin(file_ids, train_files)
+        for file_id, name in enumerate(self.trajectory_names):
+            logger.debug(
+                "{}: {} frames in the {} set".format(
+                    name,
+                    file_sizes[file_id],
+                    "training" if file_id in train_files else "test",
+                )
+            )
+        print(
+            "{} frames from {} files in the training set, {} frames from {} files in "
+            "the test set".format(
+                in_train.sum(),
+                nb_train_files,
+                (~in_train).sum(),
+                len(order) - nb_train_files,
+            )
+        )
+
+        if self.manifest:
+            self._write_manifest(
+                np.flatnonzero(in_train), np.flatnonzero(~in_train), method="file"
+            )
+            return
+
+        self._stream_split(set(np.flatnonzero(~in_train).tolist()))
+
+    @timeit
+    def split_sets_kfold(
+        self,
+        nb_folds: int = 5,
+        nb_repeats: int = 1,
+        time_blocks: bool = False,
+        nb_blocks: int = None,
+    ):
+        """
+        Split the input trajectory into nb_folds folds for cross-validation. For
+        each fold, the test set is the fold and the training set is made of the
+        other folds. All the folds are written in a single pass over the input
+        trajectory, as [trajectory]_fold[k]_train.traj and _test.traj files (or
+        as index manifests [trajectory]_fold[k]_split.json). With repetitions, the
+        files are named [trajectory]_repeat[r]_fold[k]. The training_set_percentage
+        is not used.
+        Args:
+            nb_folds (int, optional): Number of folds. Defaults to 5.
+            nb_repeats (int, optional): Number of repetitions of the K-fold split,
+                each with a different shuffling. Defaults to 1.
+            time_blocks (bool, optional): Build the folds from blocks of
+                consecutive frames instead of single frames, so that correlated
+                frames of a molecular dynamics stay in the same fold.
+                Defaults to False.
+            nb_blocks (int, optional): Number of blocks of consecutive frames, dealt
+                to the folds after shuffling, between nb_folds and the number of
+                frames. Defaults to None (nb_folds blocks, i.e. each fold is one
+                block).
+        """
+        if not 2 <= nb_folds <= self.total_length:
+            raise ValueError(
+                "The number of folds must be between 2 and {}".format(self.total_length)
+            )
+        if time_blocks:
+            nb_blocks = nb_folds if nb_blocks is None else nb_blocks
+            if not nb_folds <= nb_blocks <= self.total_length:
+                raise ValueError(
+                    "The number of blocks must be between the number of folds ({}) "
+                    "and {}".format(nb_folds, self.total_length)
+                )
+        print("The trajectory is composed by {} frames".format(self.total_length))
+        rng = np.random.default_rng(self.seed)
+
+        # Fold of each frame, for each repetition
+        folds = np.empty((nb_repeats, self.total_length), dtype=np.int64)
+        for repeat in range(nb_repeats):
+            if time_blocks:
+                blocks = np.arange(self.total_length) * nb_blocks // self.total_length
+                fold_of_block = np.empty(nb_blocks, dtype=np.int64)
+                fold_of_block[rng.permutation(nb_blocks)] = (
+                    np.arange(nb_blocks) % nb_folds
+                )
+                folds[repeat] = fold_of_block[blocks]
+            else:
+                folds[repeat, rng.permutation(self.total_length)] = (
+                    np.arange(self.total_length) % nb_folds
+                )
+
+        # Filenames of each (repetition, fold)
+        base = self.output_name
+        self.fold_names = [
+            [
+                "{}_fold{}".format(base, fold)
+                if nb_repeats == 1
+                else "{}_repeat{}_fold{}".format(base, repeat, fold)
+                for fold in range(nb_folds)
+            ]
+            for repeat in range(nb_repeats)
+        ]
+        for repeat in range(nb_repeats):
+            sizes = np.bincount(folds[repeat], minlength=nb_folds)
+            if not sizes.all():
+                raise ValueError(
+                    "Repetition {}: fold {} is empty".format(
+                        repeat, int(np.argmin(sizes))
+                    )
+                )
+            logger.debug(
+                "Repetition {}: number of frames in each fold: {}".format(
+                    repeat, ", ".join(str(size) for size in sizes)
+                )
+            )
+        print(
+            "The {} folds are saved as {}".format(
+                nb_folds * nb_repeats, self.fold_names[0][0] + "_*"
+            )
+        )
+
+        if self.manifest:
+            sha256 = [file_hash(name) for name in self.trajectory_names]
+            for repeat in range(nb_repeats):
+                for fold, name in enumerate(self.fold_names[repeat]):
+                    in_fold = folds[repeat] == fold
+                    write_manifest(
+                        name + "_split.json",
+                        self.trajectory_names,
+                        {
+                            "train": self._source_ids(np.flatnonzero(~in_fold)),
+                            "test": self._source_ids(np.flatnonzero(in_fold)),
+                        },
+                        self.file_lengths,
+                        sha256=sha256,
+                        method="kfold",
+                        nb_folds=nb_folds,
+                        fold=fold,
+                        repeat=repeat,
+                        time_blocks=time_blocks,
+                        seed=self.seed,
+                        dedup_tolerance=self.dedup_tolerance,
+                    )
+            return
+
+        # Writing every frame in the test file of its fold and in the train files
+        # of the other folds
+        writers = [
+            [
+                (
+                    Trajectory(filename=name + "_train.traj", mode="w"),
+                    Trajectory(filename=name + "_test.traj", mode="w"),
+                )
+                for name in names
+            ]
+            for names in self.fold_names
+        ]
+        try:
+            for id, frame in enumerate(self._frames()):
+                for repeat in range(nb_repeats):
+                    for fold, (train_traj, test_traj) in enumerate(writers[repeat]):
+                        if folds[repeat, id] == fold:
+                            test_traj.write(frame)
+                        else:
+                            train_traj.write(frame)
+        finally:
+            for fold_writers in writers:
+                for train_traj, test_traj in fold_writers:
+                    train_traj.close()
+                    test_traj.close()
+
+    @timeit
+    def split_sets_diversity(
+        self,
+        nb_bins: int = 32,
+        r_max: float = 6.0,
+        energy_weight: float = 0.0,
+        nb_frames: int = None,
+    ):
+        """
+        Split the input trajectory by selecting the most diverse frames for the
+        training set, by farthest-point sampling (see amp_diversity). Each frame is
+        described by the histogram of its interatomic distances, and optionally by
+        its energy per atom. The nb_frames frames farthest from each other are
+        taken for the training set, the other frames for the test set. Well suited
+        to molecular dynamics, where consecutive frames are nearly identical.
+        Each frame selected costs one pass over the descriptors of all the frames:
+        on large trajectories, a target nb_frames much smaller than the training
+        set of training_set_percentage keeps the selection fast.
+        Args:
+            nb_bins (int, optional): Number of bins of the histogram of the
+                interatomic distances. Defaults to 32.
+            r_max (float, optional): Largest interatomic distance of the histogram,
+                in Angstrom. Defaults to 6.0.
+            energy_weight (float, optional): Weight of the energy per atom (in eV)
+                in the descriptor. Defaults to 0.0 (not used).
+            nb_frames (int, optional): Number of frames of the training set, the
+                training_set_percentage being then not used. Defaults to None
+                (nb_training frames, from training_set_percentage).
+        """
+        if nb_frames is None:
+            self.traj_get_info()
+        else:
+            if not 1 <= nb_frames <= self.total_length:
+                raise ValueError(
+                    "The number of frames of the training set must be between 1 "
+                    "and {}".format(self.total_length)
+                )
+            self.nb_training = nb_frames
+            self.nb_test = self.total_length - nb_frames
+            print("The trajectory is composed by {} frames".format(self.total_length))
+            print(
+                "The number of frames in the training set is: {}".format(
+                    self.nb_training
+                )
+            )
+            print("The number of frames in the test set is: {}".format(self.nb_test))
+            self._filename_generation()
+        if self.nb_training * self.total_length > SLOW_SAMPLING:
+            message = (
+                "Selecting {} frames among {} by farthest-point sampling may take "
+                "minutes, see nb_frames".format(self.nb_training, self.total_length)
+            )
+            print("Warning: " + message)
+            logger.warning(message)
+
+        # Descriptors of the frames, computed in one pass
+        descriptors = np.array(
+            [
+                frame_descriptor(frame, nb_bins, r_max, energy_weight)
+                for frame in self._frames()
+            ]
+        )
+        id_train = farthest_point_sampling(descriptors, self.nb_training)
+        in_train = np.zeros(self.total_length, dtype=bool)
+        in_train[id_train] = True
+        id_test = set(np.flatnonzero(~in_train).tolist())
+
+        if self.manifest:
+            self._write_manifest(
+                np.sort(id_train), sorted(id_test), method="diversity"
+            )
+            return
+
+        self._stream_split(id_test)
+
+    def _frames(self):
+        """
+        Frames used for the split, read one by one if the trajectory is not loaded.
+        """
+        if self.trajectory is not None:
+            return self.trajectory
+        frames = chain.from_iterable(
+            iread_frames(name) for name in self.trajectory_names
+        )
+        if self.frame_ids is None:
+            return frames
+        used = np.zeros(self.nb_frames, dtype=bool)
+        used[self.frame_ids] = True
+        return (frame for id, frame in enumerate(frames) if used[id])
+
+    def _source_ids(self, ids):
+        """
+        Indexes in the input trajectory of frames used for the split.
+        """
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if self.frame_ids is None:
+            return ids
+        return self.frame_ids[ids]
+
+    def _write_manifest(self, id_train, id_test, method, **parameters):
+        """
+        Save the split as an index manifest (see amp_manifest)
+        Args:
+            id_train (iterable): Indexes of the frames of the training set
+            id_test (iterable): Indexes of the frames of the test set
+            method (str): Name of the split method
+            parameters: Other parameters of the split method, saved in the manifest
+        """
+        write_manifest(
+            self.manifest_name,
+            self.trajectory_names,
+            {"train": self._source_ids(id_train), "test": self._source_ids(id_test)},
+            self.file_lengths,
+            method=method,
+            training_set_percentage=self.training_set_percentage,
+            seed=self.seed,
+            dedup_tolerance=self.dedup_tolerance,
+            **parameters,
+        )
+
+    def _stream_split(self, id_test, id_train=None):
+        """
+        Write the train and test trajectories in a single pass over the input
+        trajectory, keeping only one frame in memory if it is not loaded. The frames
+        are written in the order of the input trajectory.
+        Args:
+            id_test (set or range): Indexes of the frames of the test set
+            id_train (set, optional): Indexes of the frames of the training set.
+                Defaults to None (all the frames not in the test set).
+        """
+        self.train_traj = Trajectory(filename=self.train_traj_name, mode="w")
+        self.test_traj = Trajectory(filename=self.test_traj_name, mode="w")
+        try:
+            for id, frame in enumerate(self._frames()):
+                if id in id_test:
+                    self.test_traj.write(frame)
+                elif id_train is None or id in id_train:
+                    self.train_traj.write(frame)
+        finally:
+            self.train_traj.close()
+            self.test_traj.close()
+
 
 if __name__ == "__main__":
     print("The python script {} is running as main".format(__file__))